@@ -15,7 +15,6 @@ import asyncio
 import logging
 import json
 import shutil
-import aiosqlite
 from pyrogram import Client
 from pyrogram.errors import (
     SessionPasswordNeeded, PhoneCodeInvalid, PhoneCodeExpired,
@@ -23,7 +22,7 @@ from pyrogram.errors import (
     ChannelPrivate, PeerIdInvalid, UsernameInvalid, UsernameNotOccupied
 )
 from pyrogram.enums import ChatMemberStatus
-from utils import normalize_media_type, is_valid_file_id
+from utils import normalize_media_type, is_valid_file_id, DatabaseLogHandler
 
 # Load environment variables
 load_dotenv()
@@ -87,42 +86,22 @@ def normalize_channel_id(channel_id: str) -> Union[int, str]:
         return channel_id
 
 
-class DatabaseLogHandler(logging.Handler):
-    """Custom logging handler to save logs to database"""
-    def emit(self, record):
-        try:
-            import asyncio
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                asyncio.create_task(self.async_emit(record))
-            else:
-                loop.run_until_complete(self.async_emit(record))
-        except Exception:
-            pass
-    
-    async def async_emit(self, record):
-        try:
-            await db.add_log(
-                level=record.levelname,
-                source="admin_panel",
-                message=record.getMessage(),
-                details=str(record.__dict__)
-            )
-        except Exception:
-            pass
-
-
 # Add database handler to logger
-db_handler = DatabaseLogHandler()
+db_handler = DatabaseLogHandler(db, "admin_panel")
 db_handler.setLevel(logging.INFO)
 logger.addHandler(db_handler)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database on startup"""
+    """Open the shared database connection on startup and close it on shutdown"""
+    await db.connect()
     await db.init_db()
+    log_drain_task = asyncio.create_task(db_handler.drain_queue())
     yield
+    log_drain_task.cancel()
+    await db_handler.flush_queue()
+    await db.close()
 
 
 # Initialize FastAPI app
@@ -331,20 +310,28 @@ async def logout(request: Request):
 
 
 @app.get("/admin/users", response_class=HTMLResponse, dependencies=[Depends(require_auth)])
-async def users_page(request: Request, search: str = None, is_banned: int = None, page: int = 1):
+async def users_page(request: Request, search: str = None, is_banned: int = None, page: int = 1,
+                     after_date: str = None, after_id: int = None):
     """Users management page"""
     limit = 20
     offset = (page - 1) * limit
+    # "Next" links carry the last row's (join_date, id) so the query can seek
+    # to the page; numbered links fall back to the offset
+    after = (after_date, after_id) if after_date and after_id is not None else None
     
-    users = await db.get_users(search=search, is_banned=is_banned, limit=limit, offset=offset)
-    total = await db.get_user_count(search=search, is_banned=is_banned)
+    users, total = await db.get_users_page(search=search, is_banned=is_banned, limit=limit, offset=offset, after=after)
+    if after:
+        # With a cursor the count only covers this page onwards
+        total += offset
     total_pages = (total + limit - 1) // limit
+    next_cursor = (users[-1]['join_date'], users[-1]['id']) if users else None
     
     return templates.TemplateResponse("users.html", {
         "request": request,
         "users": users,
         "page": page,
         "total_pages": total_pages,
+        "next_cursor": next_cursor,
         "search": search or "",
         "is_banned": is_banned
     })
@@ -470,11 +457,15 @@ async def invite_requests_page(
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
     older_than_count: Optional[str] = Query(None),
-    search: Optional[str] = Query(None)
+    search: Optional[str] = Query(None),
+    after_date: Optional[str] = Query(None),
+    after_id: Optional[int] = Query(None)
 ):
     """Invite requests page"""
     limit = 20
     offset = (page - 1) * limit
+    # "Next" links carry the last row's (request_date, id), as on the users page
+    after = (after_date, after_id) if after_date and after_id is not None else None
     
     # Handle empty string for status (treat as None for 'All')
     if status == '':
@@ -484,7 +475,7 @@ async def invite_requests_page(
     chat_id_int = parse_optional_int(chat_id, allow_negative=True)
     older_than_count_int = parse_optional_int(older_than_count, allow_negative=False)
     
-    requests = await db.get_join_requests(
+    requests, total = await db.get_join_requests_page(
         status=status, 
         limit=limit, 
         offset=offset,
@@ -492,17 +483,14 @@ async def invite_requests_page(
         date_from=date_from,
         date_to=date_to,
         older_than_count=older_than_count_int,
-        search=search
-    )
-    total = await db.get_join_request_count(
-        status=status,
-        chat_id=chat_id_int,
-        date_from=date_from,
-        date_to=date_to,
-        older_than_count=older_than_count_int,
-        search=search
+        search=search,
+        before=after
     )
+    if after:
+        # With a cursor the count only covers this page onwards
+        total += offset
     total_pages = (total + limit - 1) // limit
+    next_cursor = (requests[-1]['request_date'], requests[-1]['id']) if requests else None
     
     # Get distinct chat IDs for filter dropdown
     chat_ids = await db.get_distinct_chat_ids()
@@ -518,7 +506,8 @@ async def invite_requests_page(
         "date_from": date_from,
         "date_to": date_to,
         "older_than_count": older_than_count_int,
-        "search": search
+        "search": search,
+        "next_cursor": next_cursor
     })
 
 
@@ -548,7 +537,7 @@ async def invite_links_page(request: Request):
             if bot:
                 bot_info = await bot.get_me()
                 bot_username = bot_info.username
-                await db.save_setting('bot_username', bot_username)
+                await db.set_setting('bot_username', bot_username)
         except:
             bot_username = "YourBot"
     
@@ -563,24 +552,27 @@ async def invite_links_page(request: Request):
 @app.post("/api/users/ban")
 async def ban_users(user_ids: List[int], _: None = Depends(require_auth)):
     """Ban selected users"""
-    for user_id in user_ids:
-        await db.ban_user(user_id)
+    async with db.transaction():
+        for user_id in user_ids:
+            await db.ban_user(user_id)
     return {"status": "success", "message": f"Banned {len(user_ids)} users"}
 
 
 @app.post("/api/users/unban")
 async def unban_users(user_ids: List[int], _: None = Depends(require_auth)):
     """Unban selected users"""
-    for user_id in user_ids:
-        await db.unban_user(user_id)
+    async with db.transaction():
+        for user_id in user_ids:
+            await db.unban_user(user_id)
     return {"status": "success", "message": f"Unbanned {len(user_ids)} users"}
 
 
 @app.post("/api/users/delete")
 async def delete_users(user_ids: List[int], _: None = Depends(require_auth)):
     """Delete selected users"""
-    for user_id in user_ids:
-        await db.delete_user(user_id)
+    async with db.transaction():
+        for user_id in user_ids:
+            await db.delete_user(user_id)
     return {"status": "success", "message": f"Deleted {len(user_ids)} users"}
 
 
@@ -606,17 +598,20 @@ async def send_message(request: MessageRequest, _: None = Depends(require_auth))
         
         success_count = 0
         fail_count = 0
+        actions = []
         
         for user_id in request.user_ids:
             try:
                 await bot_instance.send_message(user_id, text, parse_mode=parse_mode)
                 success_count += 1
-                await db.log_action(user_id, "received_message", "Message sent via admin panel")
+                actions.append((user_id, "received_message", "Message sent via admin panel"))
                 await asyncio.sleep(0.05)  # Rate limiting
             except Exception as e:
                 fail_count += 1
         
         await bot_instance.session.close()
+        if actions:
+            await db.log_actions_many(actions)
         
         return {
             "status": "success",
@@ -634,8 +629,8 @@ async def send_message(request: MessageRequest, _: None = Depends(require_auth))
 @app.post("/api/schedule/add")
 async def add_scheduled_message(request: ScheduleMessageRequest, _: None = Depends(require_auth)):
     """Add scheduled message"""
-    await db.add_scheduled_message(request.text, request.html_text, request.scheduled_time)
-    return {"status": "success", "message": "Scheduled message added"}
+    message_id = await db.add_scheduled_message(request.text, request.html_text, request.scheduled_time)
+    return {"status": "success", "message": "Scheduled message added", "id": message_id}
 
 
 @app.delete("/api/schedule/{message_id}")
@@ -653,7 +648,7 @@ async def add_static_message(request: StaticMessageRequest, _: None = Depends(re
     if not text_value:
         raise HTTPException(status_code=400, detail="Either text or html_text must be provided")
     
-    await db.add_static_message(
+    message_id = await db.add_static_message(
         request.day_number, 
         text_value, 
         request.html_text, 
@@ -663,7 +658,7 @@ async def add_static_message(request: StaticMessageRequest, _: None = Depends(re
         request.send_time,
         request.additional_minutes
     )
-    return {"status": "success", "message": "Static message added"}
+    return {"status": "success", "message": "Static message added", "id": message_id}
 
 
 @app.put("/api/static-messages/{message_id}")
@@ -698,8 +693,8 @@ async def delete_static_message(message_id: int, _: None = Depends(require_auth)
 @app.post("/api/static-messages/{message_id}/toggle")
 async def toggle_static_message(message_id: int, _: None = Depends(require_auth)):
     """Toggle static message active status"""
-    await db.toggle_static_message(message_id)
-    return {"status": "success", "message": "Static message toggled"}
+    is_active = await db.toggle_static_message(message_id)
+    return {"status": "success", "message": "Static message toggled", "is_active": is_active}
 
 
 class SendTestRequest(BaseModel):
@@ -722,20 +717,11 @@ async def send_test_message(message_id: int, request: SendTestRequest, _: None =
             raise HTTPException(status_code=400, detail="Bot token not configured")
         
         # Get the static message from database
-        async with aiosqlite.connect(db.db_path) as conn:
-            conn.row_factory = aiosqlite.Row
-            cursor = await conn.execute(
-                "SELECT * FROM static_messages WHERE id = ?",
-                (message_id,)
-            )
-            row = await cursor.fetchone()
+        msg = await db.get_static_message(message_id)
         
-        if not row:
+        if not msg:
             raise HTTPException(status_code=404, detail="Static message not found")
         
-        # Convert row to dict
-        msg = dict(row)
-        
         # Determine target user ID
         target = request.target.strip()
         user_id = None
@@ -744,49 +730,29 @@ async def send_test_message(message_id: int, request: SendTestRequest, _: None =
         if target.isdigit():
             user_id = int(target)
             # Verify user exists in database
-            async with aiosqlite.connect(db.db_path) as conn:
-                cursor = await conn.execute(
-                    "SELECT user_id FROM users WHERE user_id = ?",
-                    (user_id,)
+            if not await db.user_exists(user_id):
+                raise HTTPException(
+                    status_code=404, 
+                    detail=f"User ID {user_id} not found in database. The user must have interacted with the bot before you can send them a test message."
                 )
-                result = await cursor.fetchone()
-                if not result:
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"User ID {user_id} not found in database. The user must have interacted with the bot before you can send them a test message."
-                    )
         elif target.startswith('@'):
             # Remove @ if present
             username = target[1:]
             # Try to find user by username in database
-            async with aiosqlite.connect(db.db_path) as conn:
-                cursor = await conn.execute(
-                    "SELECT user_id FROM users WHERE username = ?",
-                    (username,)
+            user_id = await db.get_user_id_by_username(username)
+            if not user_id:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Username '@{username}' not found in database. The user must have interacted with the bot before you can send them a test message."
                 )
-                result = await cursor.fetchone()
-                if result:
-                    user_id = result[0]
-                else:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Username '@{username}' not found in database. The user must have interacted with the bot before you can send them a test message."
-                    )
         else:
             # Assume it's a username without @
-            async with aiosqlite.connect(db.db_path) as conn:
-                cursor = await conn.execute(
-                    "SELECT user_id FROM users WHERE username = ?",
-                    (target,)
+            user_id = await db.get_user_id_by_username(target)
+            if not user_id:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Username '{target}' not found in database. The user must have interacted with the bot before you can send them a test message."
                 )
-                result = await cursor.fetchone()
-                if result:
-                    user_id = result[0]
-                else:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Username '{target}' not found in database. The user must have interacted with the bot before you can send them a test message."
-                    )
         
         if not user_id:
             raise HTTPException(status_code=400, detail="Invalid target format. Use numeric user ID or username.")
@@ -1045,8 +1011,9 @@ async def upload_media(
 async def save_settings(settings: dict, _: None = Depends(require_auth)):
     """Save settings"""
     logger.info(f"Updating settings: {list(settings.keys())}")
-    for key, value in settings.items():
-        await db.set_setting(key, value)
+    async with db.transaction():
+        for key, value in settings.items():
+            await db.set_setting(key, value)
     return {"status": "success", "message": "Settings saved"}
 
 
@@ -1155,15 +1122,24 @@ async def get_logs(
     level: str = None,
     offset: int = 0,
     limit: int = 1000,
+    before_created_at: str = None,
+    before_id: int = None,
     _: None = Depends(require_auth)
 ):
-    """Get logs with filters"""
-    logs = await db.get_logs(source=source, level=level, limit=limit, offset=offset)
-    total = await db.get_logs_count(source=source, level=level)
+    """Get logs with filters
+    
+    Clients paging with "load more" should send back `next_cursor` as
+    before_created_at/before_id; offset is kept for older clients. With a
+    cursor, `total` counts the entries from the cursor on.
+    """
+    before = (before_created_at, before_id) if before_created_at and before_id is not None else None
+    logs, total = await db.get_logs_page(source=source, level=level, limit=limit, offset=offset, before=before)
+    next_cursor = {"created_at": logs[-1]['created_at'], "id": logs[-1]['id']} if logs else None
     return {
         "logs": logs,
         "total": total,
-        "has_more": offset + limit < total
+        "has_more": len(logs) < total if before else offset + limit < total,
+        "next_cursor": next_cursor
     }
 
 
@@ -1187,14 +1163,14 @@ async def get_menu(_: None = Depends(require_auth)):
 async def add_menu_item(request: MenuItemRequest, _: None = Depends(require_auth)):
     """Add menu item"""
     logger.info(f"Adding menu item: {request.button_name}")
-    await db.add_bot_menu_item(
+    menu_id = await db.add_bot_menu_item(
         request.button_name,
         request.button_order,
         request.button_type,
         request.action_value,
         request.inline_buttons
     )
-    return {"status": "success", "message": "Menu item added"}
+    return {"status": "success", "message": "Menu item added", "id": menu_id}
 
 
 @app.put("/api/menu/{menu_id}")
@@ -1224,8 +1200,8 @@ async def delete_menu_item(menu_id: int, _: None = Depends(require_auth)):
 async def toggle_menu_item(menu_id: int, _: None = Depends(require_auth)):
     """Toggle menu item active status"""
     logger.info(f"Toggling menu item: {menu_id}")
-    await db.toggle_bot_menu_item(menu_id)
-    return {"status": "success", "message": "Menu item toggled"}
+    is_active = await db.toggle_bot_menu_item(menu_id)
+    return {"status": "success", "message": "Menu item toggled", "is_active": is_active}
 
 
 # Helper function to get chat info with caching
@@ -1261,6 +1237,21 @@ async def get_chat_info_cached(bot_instance, chat_id: int, cache: dict) -> str:
         return f"Chat {chat_id}"
 
 
+@asynccontextmanager
+async def recorded_join_request_decisions(record):
+    """Collect the ids of join requests Telegram accepted a decision for and
+    pass them to ``record`` in one write on exit.
+
+    The write runs even if the loop is cut short by a cancellation or an
+    error, because Telegram has already applied those decisions.
+    """
+    decided_ids = []
+    try:
+        yield decided_ids
+    finally:
+        await record(decided_ids)
+
+
 # Invite requests API endpoints
 @app.post("/api/invite-requests/approve")
 async def approve_join_requests(request: ApproveRequestsWithSession, _: None = Depends(require_auth)):
@@ -1269,6 +1260,11 @@ async def approve_join_requests(request: ApproveRequestsWithSession, _: None = D
         success_count = 0
         fail_count = 0
         chat_info_cache = {}
+        # Decisions are recorded after the loop, so a repeated id would
+        # still look pending and be sent to Telegram twice
+        request_ids = list(dict.fromkeys(request.request_ids))
+        # Look up every selected request in one query up front
+        join_requests = await db.get_join_requests_by_ids(request_ids)
         
         # Determine which client to use
         if request.session_name:
@@ -1297,47 +1293,47 @@ async def approve_join_requests(request: ApproveRequestsWithSession, _: None = D
             try:
                 await client.start()
                 
-                # Process requests with Pyrogram
-                for request_id in request.request_ids:
-                    join_request = None
-                    try:
-                        # Get request details
-                        join_request = await db.get_join_request_by_id(request_id)
-                        if not join_request or join_request['status'] != 'pending':
+                async with recorded_join_request_decisions(db.approve_join_requests) as approved_ids:
+                    # Process requests with Pyrogram
+                    for request_id in request_ids:
+                        join_request = None
+                        try:
+                            # Get request details
+                            join_request = join_requests.get(request_id)
+                            if not join_request or join_request['status'] != 'pending':
+                                fail_count += 1
+                                continue
+                            
+                            chat_id = int(join_request['chat_id'])
+                            user_id = int(join_request['user_id'])
+                            
+                            # Get chat info with caching (Pyrogram)
+                            if chat_id in chat_info_cache:
+                                chat_title = chat_info_cache[chat_id]
+                            else:
+                                try:
+                                    chat = await client.get_chat(chat_id)
+                                    chat_title = chat.title if hasattr(chat, 'title') else f"Chat {chat_id}"
+                                    chat_info_cache[chat_id] = chat_title
+                                except Exception as e:
+                                    logger.warning(f"Could not fetch chat info for chat_id {chat_id}: {e}")
+                                    chat_title = f"Chat {chat_id}"
+                            
+                            logger.info(f"Approving join request {request_id} for user {user_id} in channel: {chat_title} (chat_id: {chat_id}) using session {request.session_name}")
+                            
+                            # Approve using Pyrogram
+                            await client.approve_chat_join_request(
+                                chat_id=chat_id,
+                                user_id=user_id
+                            )
+                            
+                            approved_ids.append(request_id)
+                            await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}, Session: {request.session_name}")
+                            success_count += 1
+                            logger.info(f"Successfully approved join request {request_id} for user {user_id} in channel: {chat_title}")
+                        except Exception as e:
+                            logger.error(f"Error approving join request {request_id} (chat_id: {join_request.get('chat_id', 'unknown') if join_request else 'unknown'}): {e}")
                             fail_count += 1
-                            continue
-                        
-                        chat_id = int(join_request['chat_id'])
-                        user_id = int(join_request['user_id'])
-                        
-                        # Get chat info with caching (Pyrogram)
-                        if chat_id in chat_info_cache:
-                            chat_title = chat_info_cache[chat_id]
-                        else:
-                            try:
-                                chat = await client.get_chat(chat_id)
-                                chat_title = chat.title if hasattr(chat, 'title') else f"Chat {chat_id}"
-                                chat_info_cache[chat_id] = chat_title
-                            except Exception as e:
-                                logger.warning(f"Could not fetch chat info for chat_id {chat_id}: {e}")
-                                chat_title = f"Chat {chat_id}"
-                        
-                        logger.info(f"Approving join request {request_id} for user {user_id} in channel: {chat_title} (chat_id: {chat_id}) using session {request.session_name}")
-                        
-                        # Approve using Pyrogram
-                        await client.approve_chat_join_request(
-                            chat_id=chat_id,
-                            user_id=user_id
-                        )
-                        
-                        # Update database
-                        await db.approve_join_request(request_id)
-                        await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}, Session: {request.session_name}")
-                        success_count += 1
-                        logger.info(f"Successfully approved join request {request_id} for user {user_id} in channel: {chat_title}")
-                    except Exception as e:
-                        logger.error(f"Error approving join request {request_id} (chat_id: {join_request.get('chat_id', 'unknown') if join_request else 'unknown'}): {e}")
-                        fail_count += 1
             finally:
                 await client.stop()
         else:
@@ -1355,39 +1351,39 @@ async def approve_join_requests(request: ApproveRequestsWithSession, _: None = D
             bot_instance = Bot(token=bot_token)
             
             try:
-                # Process requests with aiogram
-                for request_id in request.request_ids:
-                    join_request = None
-                    try:
-                        # Get request details
-                        join_request = await db.get_join_request_by_id(request_id)
-                        if not join_request or join_request['status'] != 'pending':
+                async with recorded_join_request_decisions(db.approve_join_requests) as approved_ids:
+                    # Process requests with aiogram
+                    for request_id in request_ids:
+                        join_request = None
+                        try:
+                            # Get request details
+                            join_request = join_requests.get(request_id)
+                            if not join_request or join_request['status'] != 'pending':
+                                fail_count += 1
+                                continue
+                            
+                            chat_id = int(join_request['chat_id'])
+                            user_id = int(join_request['user_id'])
+                            
+                            # Get chat info for logging (with caching)
+                            chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
+                            
+                            # Log the approval attempt with channel info
+                            logger.info(f"Approving join request {request_id} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
+                            
+                            # Approve the join request
+                            await bot_instance.approve_chat_join_request(
+                                chat_id=chat_id,
+                                user_id=user_id
+                            )
+                            
+                            approved_ids.append(request_id)
+                            await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}")
+                            success_count += 1
+                            logger.info(f"Successfully approved join request {request_id} for user {user_id} in channel: {chat_title}")
+                        except Exception as e:
+                            logger.error(f"Error approving join request {request_id} (chat_id: {join_request.get('chat_id', 'unknown') if join_request else 'unknown'}): {e}")
                             fail_count += 1
-                            continue
-                        
-                        chat_id = int(join_request['chat_id'])
-                        user_id = int(join_request['user_id'])
-                        
-                        # Get chat info for logging (with caching)
-                        chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
-                        
-                        # Log the approval attempt with channel info
-                        logger.info(f"Approving join request {request_id} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
-                        
-                        # Approve the join request
-                        await bot_instance.approve_chat_join_request(
-                            chat_id=chat_id,
-                            user_id=user_id
-                        )
-                        
-                        # Update database
-                        await db.approve_join_request(request_id)
-                        await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}")
-                        success_count += 1
-                        logger.info(f"Successfully approved join request {request_id} for user {user_id} in channel: {chat_title}")
-                    except Exception as e:
-                        logger.error(f"Error approving join request {request_id} (chat_id: {join_request.get('chat_id', 'unknown') if join_request else 'unknown'}): {e}")
-                        fail_count += 1
             finally:
                 await bot_instance.session.close()
         
@@ -1423,41 +1419,46 @@ async def deny_join_requests(request_ids: List[int], _: None = Depends(require_a
         success_count = 0
         fail_count = 0
         chat_info_cache = {}  # Cache for chat info to avoid redundant API calls
+        # Drop repeated ids, as approve_join_requests does
+        request_ids = list(dict.fromkeys(request_ids))
+        # Look up every selected request in one query up front
+        join_requests = await db.get_join_requests_by_ids(request_ids)
         
-        for request_id in request_ids:
-            join_request = None
-            try:
-                # Get request details
-                join_request = await db.get_join_request_by_id(request_id)
-                if not join_request or join_request['status'] != 'pending':
-                    fail_count += 1
-                    continue
-                
-                chat_id = int(join_request['chat_id'])
-                user_id = int(join_request['user_id'])
-                
-                # Get chat info for logging (with caching)
-                chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
-                
-                # Log the deny attempt with channel info
-                logger.info(f"Denying join request {request_id} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
-                
-                # Deny the join request
-                await bot_instance.decline_chat_join_request(
-                    chat_id=chat_id,
-                    user_id=user_id
-                )
-                
-                # Update database
-                await db.deny_join_request(request_id)
-                await db.log_action(user_id, "join_request_denied", f"Chat ID: {chat_id}, Channel: {chat_title}")
-                success_count += 1
-                logger.info(f"Successfully denied join request {request_id} for user {user_id} in channel: {chat_title}")
-            except Exception as e:
-                logger.error(f"Error denying join request {request_id} (chat_id: {join_request.get('chat_id', 'unknown') if join_request else 'unknown'}): {e}")
-                fail_count += 1
-        
-        await bot_instance.session.close()
+        try:
+            async with recorded_join_request_decisions(db.deny_join_requests) as denied_ids:
+                for request_id in request_ids:
+                    join_request = None
+                    try:
+                        # Get request details
+                        join_request = join_requests.get(request_id)
+                        if not join_request or join_request['status'] != 'pending':
+                            fail_count += 1
+                            continue
+                        
+                        chat_id = int(join_request['chat_id'])
+                        user_id = int(join_request['user_id'])
+                        
+                        # Get chat info for logging (with caching)
+                        chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
+                        
+                        # Log the deny attempt with channel info
+                        logger.info(f"Denying join request {request_id} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
+                        
+                        # Deny the join request
+                        await bot_instance.decline_chat_join_request(
+                            chat_id=chat_id,
+                            user_id=user_id
+                        )
+                        
+                        denied_ids.append(request_id)
+                        await db.log_action(user_id, "join_request_denied", f"Chat ID: {chat_id}, Channel: {chat_title}")
+                        success_count += 1
+                        logger.info(f"Successfully denied join request {request_id} for user {user_id} in channel: {chat_title}")
+                    except Exception as e:
+                        logger.error(f"Error denying join request {request_id} (chat_id: {join_request.get('chat_id', 'unknown') if join_request else 'unknown'}): {e}")
+                        fail_count += 1
+        finally:
+            await bot_instance.session.close()
         
         return {
             "status": "success",
@@ -1479,7 +1480,7 @@ async def approve_all_join_requests(request: ApproveAllWithSession, _: None = De
         success_count = 0
         fail_count = 0
         batch_size = 100
-        offset = 0
+        cursor = None  # (request_date, id) of the last request handled
         chat_info_cache = {}
         
         # Determine which client to use
@@ -1511,46 +1512,47 @@ async def approve_all_join_requests(request: ApproveAllWithSession, _: None = De
                 
                 # Process all pending requests with Pyrogram
                 while True:
-                    pending_requests = await db.get_join_requests(status='pending', limit=batch_size, offset=offset)
+                    pending_requests = await db.get_join_requests(status='pending', limit=batch_size, before=cursor)
                     if not pending_requests:
                         break
                     
-                    for join_request in pending_requests:
-                        try:
-                            chat_id = int(join_request['chat_id'])
-                            user_id = int(join_request['user_id'])
-                            
-                            # Get chat info with caching (Pyrogram)
-                            if chat_id in chat_info_cache:
-                                chat_title = chat_info_cache[chat_id]
-                            else:
-                                try:
-                                    chat = await client.get_chat(chat_id)
-                                    chat_title = chat.title if hasattr(chat, 'title') else f"Chat {chat_id}"
-                                    chat_info_cache[chat_id] = chat_title
-                                except Exception as e:
-                                    logger.warning(f"Could not fetch chat info for chat_id {chat_id}: {e}")
-                                    chat_title = f"Chat {chat_id}"
-                            
-                            logger.info(f"Auto-approving join request {join_request['id']} for user {user_id} in channel: {chat_title} (chat_id: {chat_id}) using session {request.session_name}")
-                            
-                            # Approve using Pyrogram
-                            await client.approve_chat_join_request(
-                                chat_id=chat_id,
-                                user_id=user_id
-                            )
-                            
-                            # Update database
-                            await db.approve_join_request(join_request['id'])
-                            await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}, Session: {request.session_name}")
-                            success_count += 1
-                            logger.info(f"Successfully auto-approved join request {join_request['id']} for user {user_id} in channel: {chat_title}")
-                        except Exception as e:
-                            logger.error(f"Error approving join request {join_request['id']} (chat_id: {join_request.get('chat_id', 'unknown')}): {e}")
-                            fail_count += 1
+                    async with recorded_join_request_decisions(db.approve_join_requests) as approved_ids:
+                        for join_request in pending_requests:
+                            try:
+                                chat_id = int(join_request['chat_id'])
+                                user_id = int(join_request['user_id'])
+                                
+                                # Get chat info with caching (Pyrogram)
+                                if chat_id in chat_info_cache:
+                                    chat_title = chat_info_cache[chat_id]
+                                else:
+                                    try:
+                                        chat = await client.get_chat(chat_id)
+                                        chat_title = chat.title if hasattr(chat, 'title') else f"Chat {chat_id}"
+                                        chat_info_cache[chat_id] = chat_title
+                                    except Exception as e:
+                                        logger.warning(f"Could not fetch chat info for chat_id {chat_id}: {e}")
+                                        chat_title = f"Chat {chat_id}"
+                                
+                                logger.info(f"Auto-approving join request {join_request['id']} for user {user_id} in channel: {chat_title} (chat_id: {chat_id}) using session {request.session_name}")
+                                
+                                # Approve using Pyrogram
+                                await client.approve_chat_join_request(
+                                    chat_id=chat_id,
+                                    user_id=user_id
+                                )
+                                
+                                approved_ids.append(join_request['id'])
+                                await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}, Session: {request.session_name}")
+                                success_count += 1
+                                logger.info(f"Successfully auto-approved join request {join_request['id']} for user {user_id} in channel: {chat_title}")
+                            except Exception as e:
+                                logger.error(f"Error approving join request {join_request['id']} (chat_id: {join_request.get('chat_id', 'unknown')}): {e}")
+                                fail_count += 1
                     
-                    # Move to next batch
-                    offset += batch_size
+                    # Move to next batch by cursor; an offset would skip requests
+                    # that already left 'pending'
+                    cursor = (pending_requests[-1]['request_date'], pending_requests[-1]['id'])
             finally:
                 await client.stop()
         else:
@@ -1570,38 +1572,39 @@ async def approve_all_join_requests(request: ApproveAllWithSession, _: None = De
             try:
                 # Process all pending requests with aiogram
                 while True:
-                    pending_requests = await db.get_join_requests(status='pending', limit=batch_size, offset=offset)
+                    pending_requests = await db.get_join_requests(status='pending', limit=batch_size, before=cursor)
                     if not pending_requests:
                         break
                     
-                    for join_request in pending_requests:
-                        try:
-                            chat_id = int(join_request['chat_id'])
-                            user_id = int(join_request['user_id'])
-                            
-                            # Get chat info for logging (with caching)
-                            chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
-                            
-                            # Log the approval attempt with channel info
-                            logger.info(f"Auto-approving join request {join_request['id']} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
-                            
-                            # Approve the join request
-                            await bot_instance.approve_chat_join_request(
-                                chat_id=chat_id,
-                                user_id=user_id
-                            )
-                            
-                            # Update database
-                            await db.approve_join_request(join_request['id'])
-                            await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}")
-                            success_count += 1
-                            logger.info(f"Successfully auto-approved join request {join_request['id']} for user {user_id} in channel: {chat_title}")
-                        except Exception as e:
-                            logger.error(f"Error approving join request {join_request['id']} (chat_id: {join_request.get('chat_id', 'unknown')}): {e}")
-                            fail_count += 1
+                    async with recorded_join_request_decisions(db.approve_join_requests) as approved_ids:
+                        for join_request in pending_requests:
+                            try:
+                                chat_id = int(join_request['chat_id'])
+                                user_id = int(join_request['user_id'])
+                                
+                                # Get chat info for logging (with caching)
+                                chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
+                                
+                                # Log the approval attempt with channel info
+                                logger.info(f"Auto-approving join request {join_request['id']} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
+                                
+                                # Approve the join request
+                                await bot_instance.approve_chat_join_request(
+                                    chat_id=chat_id,
+                                    user_id=user_id
+                                )
+                                
+                                approved_ids.append(join_request['id'])
+                                await db.log_action(user_id, "join_request_approved", f"Chat ID: {chat_id}, Channel: {chat_title}")
+                                success_count += 1
+                                logger.info(f"Successfully auto-approved join request {join_request['id']} for user {user_id} in channel: {chat_title}")
+                            except Exception as e:
+                                logger.error(f"Error approving join request {join_request['id']} (chat_id: {join_request.get('chat_id', 'unknown')}): {e}")
+                                fail_count += 1
                     
-                    # Move to next batch
-                    offset += batch_size
+                    # Move to next batch by cursor; an offset would skip requests
+                    # that already left 'pending'
+                    cursor = (pending_requests[-1]['request_date'], pending_requests[-1]['id'])
             finally:
                 await bot_instance.session.close()
         
@@ -1638,42 +1641,43 @@ async def deny_all_join_requests(_: None = Depends(require_auth)):
         success_count = 0
         fail_count = 0
         batch_size = 100
-        offset = 0
+        cursor = None  # (request_date, id) of the last request handled
         chat_info_cache = {}  # Cache for chat info to avoid redundant API calls
         
         while True:
-            pending_requests = await db.get_join_requests(status='pending', limit=batch_size, offset=offset)
+            pending_requests = await db.get_join_requests(status='pending', limit=batch_size, before=cursor)
             if not pending_requests:
                 break
             
-            for join_request in pending_requests:
-                try:
-                    chat_id = int(join_request['chat_id'])
-                    user_id = int(join_request['user_id'])
-                    
-                    # Get chat info for logging (with caching)
-                    chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
-                    
-                    # Log the deny attempt with channel info
-                    logger.info(f"Auto-denying join request {join_request['id']} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
-                    
-                    # Deny the join request
-                    await bot_instance.decline_chat_join_request(
-                        chat_id=chat_id,
-                        user_id=user_id
-                    )
-                    
-                    # Update database
-                    await db.deny_join_request(join_request['id'])
-                    await db.log_action(user_id, "join_request_denied", f"Chat ID: {chat_id}, Channel: {chat_title}")
-                    success_count += 1
-                    logger.info(f"Successfully auto-denied join request {join_request['id']} for user {user_id} in channel: {chat_title}")
-                except Exception as e:
-                    logger.error(f"Error denying join request {join_request['id']} (chat_id: {join_request.get('chat_id', 'unknown')}): {e}")
-                    fail_count += 1
+            async with recorded_join_request_decisions(db.deny_join_requests) as denied_ids:
+                for join_request in pending_requests:
+                    try:
+                        chat_id = int(join_request['chat_id'])
+                        user_id = int(join_request['user_id'])
+                        
+                        # Get chat info for logging (with caching)
+                        chat_title = await get_chat_info_cached(bot_instance, chat_id, chat_info_cache)
+                        
+                        # Log the deny attempt with channel info
+                        logger.info(f"Auto-denying join request {join_request['id']} for user {user_id} in channel: {chat_title} (chat_id: {chat_id})")
+                        
+                        # Deny the join request
+                        await bot_instance.decline_chat_join_request(
+                            chat_id=chat_id,
+                            user_id=user_id
+                        )
+                        
+                        denied_ids.append(join_request['id'])
+                        await db.log_action(user_id, "join_request_denied", f"Chat ID: {chat_id}, Channel: {chat_title}")
+                        success_count += 1
+                        logger.info(f"Successfully auto-denied join request {join_request['id']} for user {user_id} in channel: {chat_title}")
+                    except Exception as e:
+                        logger.error(f"Error denying join request {join_request['id']} (chat_id: {join_request.get('chat_id', 'unknown')}): {e}")
+                        fail_count += 1
             
-            # Move to next batch
-            offset += batch_size
+            # Move to next batch by cursor; an offset would skip requests
+            # that already left 'pending'
+            cursor = (pending_requests[-1]['request_date'], pending_requests[-1]['id'])
         
         await bot_instance.session.close()
         
@@ -2093,34 +2097,29 @@ async def pyrogram_load_requests(
             async for req in client.get_chat_join_requests(chat.id):
                 try:
                     total += 1
-                    batch.append({
-                        'user_id': req.user.id,
-                        'chat_id': chat.id,
-                        'username': req.user.username,
-                        'first_name': req.user.first_name,
-                        'last_name': req.user.last_name
-                    })
+                    batch.append((
+                        req.user.id,
+                        chat.id,
+                        req.user.username,
+                        req.user.first_name,
+                        req.user.last_name
+                    ))
                     
                     # Process in batches
                     if len(batch) >= batch_size:
-                        for item in batch:
-                            is_new = await db.add_join_request(**item)
-                            if is_new:
-                                count += 1
-                            else:
-                                skipped += 1
+                        new_count = await db.add_join_requests_many(batch)
+                        count += new_count
+                        skipped += len(batch) - new_count
                         batch = []
                 except Exception as e:
                     logger.debug(f"Skipping request: {e}")
                     continue
             
             # Process remaining items
-            for item in batch:
-                is_new = await db.add_join_request(**item)
-                if is_new:
-                    count += 1
-                else:
-                    skipped += 1
+            if batch:
+                new_count = await db.add_join_requests_many(batch)
+                count += new_count
+                skipped += len(batch) - new_count
             
             await client.stop()
             
@@ -2385,8 +2384,8 @@ async def delete_invite_link(link_id: int, _: None = Depends(require_auth)):
 async def toggle_invite_link(link_id: int, _: None = Depends(require_auth)):
     """Toggle invite link active status"""
     try:
-        await db.toggle_invite_link(link_id)
-        return {"status": "success", "message": "Invite link status toggled"}
+        is_active = await db.toggle_invite_link(link_id)
+        return {"status": "success", "message": "Invite link status toggled", "is_active": is_active}
     except Exception as e:
         logger.error(f"Error toggling invite link: {e}")
         return {"status": "error", "message": str(e)}
@@ -2880,8 +2879,8 @@ async def delete_question(question_id: int, _: None = Depends(require_auth)):
 @app.post("/api/questions/{question_id}/toggle")
 async def toggle_question(question_id: int, _: None = Depends(require_auth)):
     """Toggle question active status"""
-    await db.toggle_user_question(question_id)
-    return {"status": "success", "message": "Question status toggled"}
+    is_active = await db.toggle_user_question(question_id)
+    return {"status": "success", "message": "Question status toggled", "is_active": is_active}
 
 
 @app.get("/api/users/{user_id}/answers")
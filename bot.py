@@ -1,15 +1,18 @@
 import asyncio
-import json
+import functools
 import logging
 import os
-from datetime import datetime, timedelta
+import time
+import orjson
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command, ChatMemberUpdatedFilter, IS_MEMBER, IS_NOT_MEMBER
 from aiogram.types import ChatMemberUpdated, ChatJoinRequest, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 from database import Database
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from utils import normalize_media_type, is_valid_file_id
+from utils import normalize_media_type, is_valid_file_id, DatabaseLogHandler
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +28,10 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = None
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/bot.db")
 
+# HTTP connection pool used for Telegram Bot API requests
+BOT_HTTP_POOL_LIMIT = int(os.getenv("BOT_HTTP_POOL_LIMIT", "100"))
+BOT_HTTP_TIMEOUT = float(os.getenv("BOT_HTTP_TIMEOUT", "60"))
+
 # Initialize bot and dispatcher
 bot = None
 dp = Dispatcher()  # Create dispatcher at module level
@@ -34,31 +41,12 @@ db = Database(DATABASE_PATH)
 scheduler = AsyncIOScheduler()
 
 
-class DatabaseLogHandler(logging.Handler):
-    """Custom logging handler to save logs to database"""
-    def emit(self, record):
-        try:
-            import asyncio
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                asyncio.create_task(self.async_emit(record))
-        except Exception:
-            pass
-    
-    async def async_emit(self, record):
-        try:
-            await db.add_log(
-                level=record.levelname,
-                source="bot",
-                message=record.getMessage(),
-                details=str(record.__dict__)
-            )
-        except Exception:
-            pass
+# Days of logs kept by the hourly prune job
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
 
 
 # Add database handler to logger
-db_handler = DatabaseLogHandler()
+db_handler = DatabaseLogHandler(db, "bot")
 db_handler.setLevel(logging.INFO)
 logger.addHandler(db_handler)
 
@@ -73,6 +61,32 @@ async def get_bot_token():
     return token
 
 
+class PooledAiohttpSession(AiohttpSession):
+    """AiohttpSession with an explicitly configured connection pool
+    
+    aiogram 3.3's AiohttpSession takes no connector arguments, so the pool
+    settings are added to the connector arguments it builds its TCPConnector
+    from. All requests go to a single host (api.telegram.org), so the
+    per-host limit matches the total limit, DNS results are cached and idle
+    connections are kept alive between broadcast bursts to avoid new TLS
+    handshakes.
+    """
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_init.update(
+            limit=BOT_HTTP_POOL_LIMIT,
+            limit_per_host=BOT_HTTP_POOL_LIMIT,
+            ttl_dns_cache=300,
+            keepalive_timeout=75
+        )
+
+
+def create_bot_session():
+    """Create the aiohttp session for the bot with a tuned connection pool"""
+    return PooledAiohttpSession(timeout=BOT_HTTP_TIMEOUT)
+
+
 def init_bot():
     """Initialize bot instance only (dispatcher already created at module level).
     
@@ -91,29 +105,76 @@ def init_bot():
             # This will be handled by the caller
             return False
         
-        bot = Bot(token=BOT_TOKEN)
+        bot = Bot(token=BOT_TOKEN, session=create_bot_session())
         return True
     return True
 
 
+# Active menu items and the reply keyboard built from them. The rows come from
+# db.get_bot_menu, whose content cache is the only expiry layer for admin
+# panel edits; the keyboard is rebuilt only when those rows change.
+_menu_cache = {"items": None, "by_name": None, "markup": None}
+
+
+async def get_menu_cache():
+    """Return the menu, rebuilding the lookup and keyboard when the rows change"""
+    menu_items = await db.get_bot_menu()
+    if menu_items != _menu_cache["items"]:
+        by_name = {}
+        for item in menu_items:
+            # Items are ordered by button_order; the first one wins on duplicate names
+            by_name.setdefault(item['button_name'], item)
+        markup = None
+        if menu_items:
+            buttons = [[KeyboardButton(text=item['button_name'])] for item in menu_items]
+            markup = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+        _menu_cache.update(items=menu_items, by_name=by_name, markup=markup)
+    return _menu_cache
+
+
 async def build_main_menu():
     """Build main menu from database"""
     try:
-        menu_items = await db.get_bot_menu()
-        if not menu_items:
-            return None
-        
-        buttons = []
-        for item in menu_items:
-            button = KeyboardButton(text=item['button_name'])
-            buttons.append([button])
-        
-        return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+        return (await get_menu_cache())["markup"]
     except Exception as e:
         logger.error(f"Error building main menu: {e}")
         return None
 
 
+@functools.lru_cache(maxsize=256)
+def build_inline_markup(inline_buttons: str):
+    """Build InlineKeyboardMarkup from inline buttons JSON
+    
+    Cached on the raw JSON, so an edited config (even one saved from the
+    admin panel process) is simply a new key.
+    Returns None if the config contains no valid buttons.
+    Raises orjson.JSONDecodeError / ValueError on malformed config.
+    """
+    inline_buttons_data = orjson.loads(inline_buttons)
+    if not isinstance(inline_buttons_data, list):
+        raise ValueError("inline_buttons must be a list")
+    
+    # Buttons with an empty text or url would be rejected by Telegram and
+    # fail the whole message, so skip them. Text is limited to 100 and URLs
+    # to 500 characters
+    buttons = [
+        [InlineKeyboardButton(text=str(text)[:100], url=str(url)[:500])]
+        for btn_data in inline_buttons_data
+        if isinstance(btn_data, dict)
+        and (text := btn_data.get('text'))
+        and (url := btn_data.get('url'))
+    ]
+    
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_inline_markup(menu_item: dict):
+    """Get the inline keyboard for a menu item"""
+    return build_inline_markup(menu_item['inline_buttons'])
+
+
 async def handle_menu_action(message: types.Message, menu_item: dict):
     """Handle menu item action"""
     try:
@@ -122,31 +183,14 @@ async def handle_menu_action(message: types.Message, menu_item: dict):
         elif menu_item['button_type'] == 'text':
             await message.answer(menu_item['action_value'])
         elif menu_item['button_type'] == 'inline':
-            # Parse inline buttons from JSON with validation
+            # Parse inline buttons from JSON with validation (cached per menu item)
             try:
-                inline_buttons_data = json.loads(menu_item['inline_buttons'])
-                if not isinstance(inline_buttons_data, list):
-                    raise ValueError("inline_buttons must be a list")
-                
-                buttons = []
-                for btn_data in inline_buttons_data:
-                    if not isinstance(btn_data, dict):
-                        continue
-                    if 'text' not in btn_data or 'url' not in btn_data:
-                        continue
-                    
-                    button = InlineKeyboardButton(
-                        text=str(btn_data['text'])[:100],  # Limit text length
-                        url=str(btn_data['url'])[:500]  # Limit URL length
-                    )
-                    buttons.append([button])
-                
-                if buttons:
-                    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+                keyboard = get_inline_markup(menu_item)
+                if keyboard:
                     await message.answer("Choose an option:", reply_markup=keyboard)
                 else:
                     await message.answer("Invalid menu configuration")
-            except (json.JSONDecodeError, ValueError) as e:
+            except (orjson.JSONDecodeError, ValueError) as e:
                 logger.error(f"Error parsing inline buttons: {e}")
                 await message.answer("Error loading menu options")
     except Exception as e:
@@ -228,11 +272,10 @@ async def handle_text_message(message: types.Message):
                 return
         
         # If not in onboarding, check for menu items
-        menu_items = await db.get_bot_menu()
-        for item in menu_items:
-            if item['button_name'] == message.text:
-                await handle_menu_action(message, item)
-                return
+        menu_item = (await get_menu_cache())["by_name"].get(message.text)
+        if menu_item:
+            await handle_menu_action(message, menu_item)
+            return
                 
     except Exception as e:
         logger.error(f"Error handling text message: {e}")
@@ -322,47 +365,92 @@ async def on_join_request(update: ChatJoinRequest):
 
 async def send_message_to_users(user_ids: list, text: str, parse_mode: str = None):
     """Send message to multiple users"""
-    success_count = 0
-    fail_count = 0
-    
-    for user_id in user_ids:
-        try:
-            await bot.send_message(user_id, text, parse_mode=parse_mode)
-            success_count += 1
+    async def _send_one(user_id):
+        async with broadcast_semaphore:
+            try:
+                await send_safe(bot.send_message, user_id, text, parse_mode=parse_mode)
+            except Exception as e:
+                logger.warning(f"Could not send message to user {user_id}: {e}")
+                return False
             await db.log_action(user_id, "received_message", "Message sent via admin panel")
-            await asyncio.sleep(0.05)  # Rate limiting
-        except Exception as e:
-            logger.warning(f"Could not send message to user {user_id}: {e}")
-            fail_count += 1
+            return True
+    
+    results = await asyncio.gather(*(_send_one(user_id) for user_id in user_ids))
+    success_count = sum(results)
+    fail_count = len(results) - success_count
     
     logger.info(f"Message sent to {success_count} users, failed for {fail_count} users")
     return success_count, fail_count
 
 
+async def send_scheduled_message(msg: dict, user_ids: list):
+    """Broadcast one scheduled message and mark it as sent"""
+    text = msg['html_text'] if msg['html_text'] else msg['text']
+    parse_mode = "HTML" if msg['html_text'] else None
+    
+    await send_message_to_users(user_ids, text, parse_mode)
+    
+    # Mark as sent only after every send has completed
+    await db.mark_scheduled_message_sent(msg['id'])
+    
+    logger.info(f"Scheduled message {msg['id']} sent")
+
+
 async def check_scheduled_messages():
     """Check and send scheduled messages"""
     try:
         messages = await db.get_pending_scheduled_messages()
+        if not messages:
+            return
         
-        for msg in messages:
-            # Get all active users
-            users = await db.get_users()
-            user_ids = [user['user_id'] for user in users if not user['is_banned']]
-            
-            # Send message
-            text = msg['html_text'] if msg['html_text'] else msg['text']
-            parse_mode = "HTML" if msg['html_text'] else None
-            
-            await send_message_to_users(user_ids, text, parse_mode)
-            
-            # Mark as sent
-            await db.mark_scheduled_message_sent(msg['id'])
-            
-            logger.info(f"Scheduled message {msg['id']} sent")
+        # Get all active users once per tick, shared by every pending message
+        user_ids = [user_id async for user_id in db.iter_active_user_ids()]
+        
+        # Pending messages go out concurrently; broadcast_semaphore and the
+        # send rate limiter keep the total within Telegram's limits
+        results = await asyncio.gather(
+            *(send_scheduled_message(msg, user_ids) for msg in messages),
+            return_exceptions=True
+        )
+        for msg, result in zip(messages, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending scheduled message {msg['id']}: {result}")
     except Exception as e:
         logger.error(f"Error checking scheduled messages: {e}")
 
 
+@functools.lru_cache(maxsize=256)
+def _build_markup(buttons_config: str):
+    """Build InlineKeyboardMarkup from a button configuration string
+    
+    Cached on the exact config text; markups are immutable so they can be
+    shared between recipients. An edited config is a different key.
+    """
+    rows = []
+    for line in buttons_config.strip().split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        
+        # Split by comma for multiple buttons in one row
+        buttons_in_row = []
+        for button_str in line.split(','):
+            button_str = button_str.strip()
+            if '|' in button_str:
+                parts = button_str.split('|', 1)
+                text = parts[0].strip()
+                url = parts[1].strip()
+                if text and url:
+                    buttons_in_row.append(InlineKeyboardButton(text=text, url=url))
+        
+        if buttons_in_row:
+            rows.append(buttons_in_row)
+    
+    if rows:
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+    return None
+
+
 async def parse_buttons_config(buttons_config: str):
     """Parse button configuration string into InlineKeyboardMarkup
     Format: 
@@ -374,220 +462,211 @@ async def parse_buttons_config(buttons_config: str):
         return None
     
     try:
-        rows = []
-        for line in buttons_config.strip().split('\n'):
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Split by comma for multiple buttons in one row
-            buttons_in_row = []
-            for button_str in line.split(','):
-                button_str = button_str.strip()
-                if '|' in button_str:
-                    parts = button_str.split('|', 1)
-                    text = parts[0].strip()
-                    url = parts[1].strip()
-                    if text and url:
-                        buttons_in_row.append(InlineKeyboardButton(text=text, url=url))
-            
-            if buttons_in_row:
-                rows.append(buttons_in_row)
-        
-        if rows:
-            return InlineKeyboardMarkup(inline_keyboard=rows)
-        return None
+        return _build_markup(buttons_config)
     except Exception as e:
         logger.error(f"Error parsing buttons config: {e}")
         return None
 
 
+# Bot API method used to deliver each media type
+MEDIA_SENDERS = {
+    'photo': 'send_photo',
+    'video': 'send_video',
+    'video_note': 'send_video_note',
+    'animation': 'send_animation',
+    'document': 'send_document',
+    'audio': 'send_audio',
+    'voice': 'send_voice',
+}
+
+# Media types that can't carry a caption or buttons
+NO_CAPTION_MEDIA_TYPES = {'video_note', 'voice'}
+
+# Maximum number of static messages being sent at the same time
+STATIC_SEND_CONCURRENCY = 20
+
+# Maximum number of broadcast messages being sent at the same time, shared by
+# all concurrent broadcasts so several scheduled messages can't multiply it
+BROADCAST_CONCURRENCY = 25
+broadcast_semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+# Global cap on outgoing messages per second (Telegram allows ~30)
+BOT_SEND_RATE = int(os.getenv("BOT_SEND_RATE", "25"))
+
+
+class RateLimiter:
+    """Spread calls evenly so that at most `rate` start per second"""
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_slot = 0.0
+    
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        wait = self._next_slot - now
+        self._next_slot = max(now, self._next_slot) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+send_limiter = RateLimiter(BOT_SEND_RATE)
+
+
+async def send_safe(sender, *args, **kwargs):
+    """Call a Bot API send method under the global rate limit, waiting out Telegram flood control once"""
+    await send_limiter.acquire()
+    try:
+        return await sender(*args, **kwargs)
+    except TelegramRetryAfter as e:
+        logger.warning(f"Flood control exceeded, retrying in {e.retry_after}s")
+        await asyncio.sleep(e.retry_after)
+        await send_limiter.acquire()
+        return await sender(*args, **kwargs)
+
+
+async def deliver_static_message(user_id: int, msg: dict, days_since_join: int):
+    """Send one static message to a user. Returns True if it was delivered."""
+    # Prepare message content
+    text = msg['html_text'] if msg['html_text'] else msg['text']
+    parse_mode = "HTML" if msg['html_text'] else None
+    media_type = normalize_media_type(msg.get('media_type'))
+    media_file_id = msg.get('media_file_id')
+    
+    # Validate and normalize file_id (strip whitespace)
+    if media_file_id and isinstance(media_file_id, str):
+        media_file_id = media_file_id.strip()
+    
+    buttons_config = msg.get('buttons_config')
+    
+    # Create markup with buttons and viewed button
+    reply_markup = await create_message_markup(msg['id'], buttons_config)
+    
+    try:
+        # Send based on media type
+        if media_type in MEDIA_SENDERS and is_valid_file_id(media_file_id):
+            # Log file_id details for debugging
+            logger.info(f"Sending {media_type} with file_id: '{media_file_id}' (length: {len(media_file_id)})")
+            logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
+            sender = getattr(bot, MEDIA_SENDERS[media_type])
+            if media_type in NO_CAPTION_MEDIA_TYPES:
+                # Video notes and voice messages don't support captions or buttons, send text separately
+                await send_safe(sender, user_id, media_file_id)
+                if text:
+                    await send_safe(
+                        bot.send_message,
+                        user_id,
+                        text,
+                        parse_mode=parse_mode,
+                        reply_markup=reply_markup
+                    )
+            else:
+                await send_safe(
+                    sender,
+                    user_id,
+                    media_file_id,
+                    caption=text,
+                    parse_mode=parse_mode,
+                    reply_markup=reply_markup
+                )
+        else:
+            # Plain text, or fallback to text if media file is missing
+            if media_type != 'text' and not media_file_id:
+                logger.warning(f"Media type '{media_type}' specified but no media_file_id provided for message {msg['id']} to user {user_id}. Falling back to text only.")
+            elif media_type != 'text' and media_type not in MEDIA_SENDERS:
+                logger.warning(f"Unrecognized media type '{media_type}' for message {msg['id']} to user {user_id}. Falling back to text only.")
+            
+            if text:
+                await send_safe(
+                    bot.send_message,
+                    user_id,
+                    text,
+                    parse_mode=parse_mode,
+                    reply_markup=reply_markup
+                )
+            else:
+                logger.error(f"Cannot send message {msg['id']} to user {user_id}: no text content and media_file_id missing")
+        
+        await db.log_action(user_id, "received_static_message", f"Day {days_since_join} message (ID: {msg['id']})")
+        logger.info(f"Static message {msg['id']} sent to user {user_id} for day {days_since_join}")
+        return True
+    except Exception as e:
+        logger.warning(f"Could not send static message to user {user_id}: {e}")
+        return False
+
+
 async def send_static_messages():
     """Send static messages to users based on their join day and time"""
     try:
-        users = await db.get_users()
         static_messages = await db.get_static_messages()
-        current_time = datetime.utcnow()  # Use UTC time explicitly
+        now_ts = int(time.time())  # UTC unix timestamp
+        
+        # Parse each active message's send offset in seconds once per tick:
+        # day 0 messages are relative to the join time, later days to midnight.
+        messages_by_id = {}
+        for msg in static_messages:
+            if not msg['is_active']:
+                continue
+            offset = (msg.get('additional_minutes', 0) or 0) * 60
+            if msg['day_number'] != 0:
+                # Day 1+: Send at specific time (or default 09:00) + additional minutes
+                send_time = msg.get('send_time') or "09:00"
+                try:
+                    hour, minute = map(int, send_time.split(':'))
+                except (ValueError, AttributeError) as e:
+                    logger.warning(f"Invalid send_time format for message {msg['id']}: {send_time}, error: {e}")
+                    continue
+                offset += hour * 3600 + minute * 60
+            messages_by_id[msg['id']] = (msg, offset)
         
-        for user in users:
-            if user['is_banned']:
+        # Unsent (user, message) pairs whose day matches, filtered in SQL
+        targets = await db.get_static_message_targets(now_ts)
+        
+        # Collect (user_id, message, day) triples that are due right now
+        due = []
+        for target in targets:
+            entry = messages_by_id.get(target['static_message_id'])
+            if entry is None:
                 continue
+            msg, offset = entry
             
-            # Calculate days since join
-            join_date = datetime.fromisoformat(user['join_date'])
-            days_since_join = (current_time - join_date).days
+            # Days since join are computed in SQL (join_ts is a UTC unix timestamp)
+            join_ts = target['join_ts']
+            days_since_join = target['days_since_join']
             
-            # Find matching static messages for this day
-            for msg in static_messages:
-                if not msg['is_active'] or msg['day_number'] != days_since_join:
-                    continue
-                
-                # Check if message was already sent to this user
-                already_sent = await db.is_static_message_sent(user['user_id'], msg['id'])
-                if already_sent:
-                    continue
-                
-                # Get time configuration
-                send_time = msg.get('send_time')
-                additional_minutes = msg.get('additional_minutes', 0) or 0
-                
-                # Determine if it's time to send the message
-                should_send = False
-                
-                if days_since_join == 0:
-                    # Day 0: Send based on join time + additional minutes
-                    time_to_send = join_date + timedelta(minutes=additional_minutes)
-                    should_send = current_time >= time_to_send
-                else:
-                    # Day 1+: Send at specific time (or default 09:00) + additional minutes
-                    if not send_time:
-                        send_time = "09:00"  # Default send time
-                    
-                    # Parse send_time (HH:MM format)
-                    try:
-                        hour, minute = map(int, send_time.split(':'))
-                        target_date = join_date.date() + timedelta(days=days_since_join)
-                        from datetime import time as dt_time
-                        time_to_send = datetime.combine(target_date, dt_time(hour, minute))
-                        time_to_send += timedelta(minutes=additional_minutes)
-                        
-                        # Check if current time is within sending window (current time >= target time and < target time + 5 minutes)
-                        should_send = time_to_send <= current_time < time_to_send + timedelta(minutes=5)
-                    except (ValueError, AttributeError) as e:
-                        logger.warning(f"Invalid send_time format for message {msg['id']}: {send_time}, error: {e}")
-                        continue
-                
-                if not should_send:
-                    continue
-                
-                # Prepare message content
-                text = msg['html_text'] if msg['html_text'] else msg['text']
-                parse_mode = "HTML" if msg['html_text'] else None
-                media_type = normalize_media_type(msg.get('media_type'))
-                media_file_id = msg.get('media_file_id')
-                
-                # Validate and normalize file_id (strip whitespace)
-                if media_file_id and isinstance(media_file_id, str):
-                    media_file_id = media_file_id.strip()
-                
-                buttons_config = msg.get('buttons_config')
-                
-                # Create markup with buttons and viewed button
-                reply_markup = await create_message_markup(msg['id'], buttons_config)
+            if days_since_join == 0:
+                # Day 0: Send based on join time + additional minutes
+                should_send = now_ts >= join_ts + offset
+            else:
+                # Target time counts from midnight (UTC) of the join date
+                time_to_send = join_ts - join_ts % 86400 + days_since_join * 86400 + offset
                 
+                # Check if current time is within sending window (current time >= target time and < target time + 5 minutes)
+                should_send = time_to_send <= now_ts < time_to_send + 300
+            
+            if not should_send:
+                continue
+            
+            due.append((target['user_id'], msg, days_since_join))
+        
+        if not due:
+            return
+        
+        # Deliver due messages concurrently, bounded so we don't flood the API
+        semaphore = asyncio.Semaphore(STATIC_SEND_CONCURRENCY)
+        
+        async def _deliver(user_id, msg, days_since_join):
+            async with semaphore:
                 try:
-                    # Send based on media type
-                    if media_type == 'text':
-                        await bot.send_message(
-                            user['user_id'], 
-                            text, 
-                            parse_mode=parse_mode,
-                            reply_markup=reply_markup
-                        )
-                    elif media_type == 'photo' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending photo with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        await bot.send_photo(
-                            user['user_id'],
-                            media_file_id,
-                            caption=text,
-                            parse_mode=parse_mode,
-                            reply_markup=reply_markup
-                        )
-                    elif media_type == 'video' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending video with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        await bot.send_video(
-                            user['user_id'],
-                            media_file_id,
-                            caption=text,
-                            parse_mode=parse_mode,
-                            reply_markup=reply_markup
-                        )
-                    elif media_type == 'video_note' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending video_note with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        # Video notes don't support captions or buttons, send text separately
-                        await bot.send_video_note(user['user_id'], media_file_id)
-                        if text:
-                            await bot.send_message(
-                                user['user_id'],
-                                text,
-                                parse_mode=parse_mode,
-                                reply_markup=reply_markup
-                            )
-                    elif media_type == 'animation' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending animation with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        await bot.send_animation(
-                            user['user_id'],
-                            media_file_id,
-                            caption=text,
-                            parse_mode=parse_mode,
-                            reply_markup=reply_markup
-                        )
-                    elif media_type == 'document' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending document with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        await bot.send_document(
-                            user['user_id'],
-                            media_file_id,
-                            caption=text,
-                            parse_mode=parse_mode,
-                            reply_markup=reply_markup
-                        )
-                    elif media_type == 'audio' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending audio with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        await bot.send_audio(
-                            user['user_id'],
-                            media_file_id,
-                            caption=text,
-                            parse_mode=parse_mode,
-                            reply_markup=reply_markup
-                        )
-                    elif media_type == 'voice' and is_valid_file_id(media_file_id):
-                        # Log file_id details for debugging
-                        logger.info(f"Sending voice with file_id: '{media_file_id}' (length: {len(media_file_id)})")
-                        logger.debug(f"File_id character codes: {[ord(c) for c in media_file_id]}")
-                        # Voice messages don't support captions, send text separately
-                        await bot.send_voice(user['user_id'], media_file_id)
-                        if text:
-                            await bot.send_message(
-                                user['user_id'],
-                                text,
-                                parse_mode=parse_mode,
-                                reply_markup=reply_markup
-                            )
-                    else:
-                        # Fallback to text if media type is not recognized or media file is missing
-                        if media_type != 'text' and not media_file_id:
-                            logger.warning(f"Media type '{media_type}' specified but no media_file_id provided for message {msg['id']} to user {user['user_id']}. Falling back to text only.")
-                        elif media_type not in ['text', 'photo', 'video', 'video_note', 'animation', 'document', 'audio', 'voice']:
-                            logger.warning(f"Unrecognized media type '{media_type}' for message {msg['id']} to user {user['user_id']}. Falling back to text only.")
-                        
-                        if text:
-                            await bot.send_message(
-                                user['user_id'],
-                                text,
-                                parse_mode=parse_mode,
-                                reply_markup=reply_markup
-                            )
-                        else:
-                            logger.error(f"Cannot send message {msg['id']} to user {user['user_id']}: no text content and media_file_id missing")
-                    
-                    # Mark message as sent
-                    await db.mark_static_message_sent(user['user_id'], msg['id'])
-                    await db.log_action(user['user_id'], "received_static_message", f"Day {days_since_join} message (ID: {msg['id']})")
-                    logger.info(f"Static message {msg['id']} sent to user {user['user_id']} for day {days_since_join}")
+                    # Claim the pair before sending, as send_next_message_if_available
+                    # does, so a "viewed" click or a restart mid-run can't send it twice
+                    if not await db.try_mark_static_message_sent(user_id, msg['id']):
+                        return
+                    if not await deliver_static_message(user_id, msg, days_since_join):
+                        await db.unmark_static_message_sent(user_id, msg['id'])
                 except Exception as e:
-                    logger.warning(f"Could not send static message to user {user['user_id']}: {e}")
+                    logger.error(f"Error sending static message {msg['id']} to user {user_id}: {e}")
+        
+        await asyncio.gather(*(_deliver(*item) for item in due))
     except Exception as e:
         logger.error(f"Error sending static messages: {e}")
 
@@ -659,10 +738,10 @@ async def send_next_message_if_available(user_id: int, current_msg_id: int):
         # Find next message in sequence (same day or next day)
         next_msg = None
         for msg in static_messages:
-            if msg['is_active'] and msg['day_number'] == current_msg['day_number']:
-                # Check if there's another message on same day
-                already_sent = await db.is_static_message_sent(user_id, msg['id'])
-                if not already_sent and msg['id'] > current_msg_id:
+            if msg['is_active'] and msg['day_number'] == current_msg['day_number'] and msg['id'] > current_msg_id:
+                # Claim the next unsent message on the same day, so a repeated
+                # "viewed" click can't send it twice
+                if await db.try_mark_static_message_sent(user_id, msg['id']):
                     next_msg = msg
                     break
         
@@ -675,8 +754,11 @@ async def send_next_message_if_available(user_id: int, current_msg_id: int):
             # Add viewed button
             reply_markup = await create_message_markup(next_msg['id'], buttons_config)
             
-            await bot.send_message(user_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
-            await db.mark_static_message_sent(user_id, next_msg['id'])
+            try:
+                await bot.send_message(user_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+            except Exception:
+                await db.unmark_static_message_sent(user_id, next_msg['id'])
+                raise
             await db.log_action(user_id, "received_static_message", f"Message ID: {next_msg['id']}")
             
     except Exception as e:
@@ -714,7 +796,6 @@ async def send_next_question(user_id: int, current_question_id: int):
         else:
             # All questions answered, complete onboarding
             await db.complete_user_onboarding(user_id)
-            await db.set_user_onboarding_state(user_id, current_question_id=None)
             
             # Check if auto-approve is enabled and approve user
             auto_approve_mode = await db.get_setting('auto_approve_mode')
@@ -723,13 +804,15 @@ async def send_next_question(user_id: int, current_question_id: int):
                 join_requests = await db.get_join_requests_by_user(user_id)
                 pending_requests = [req for req in join_requests if req['status'] == 'pending']
                 
+                approved_ids = []
                 for req in pending_requests:
                     try:
                         await bot.approve_chat_join_request(int(req['chat_id']), int(user_id))
-                        await db.approve_join_request(req['id'])
+                        approved_ids.append(req['id'])
                         await db.log_action(user_id, "auto_approved", f"After onboarding completion")
                     except Exception as e:
                         logger.warning(f"Could not auto-approve join request for user {user_id}: {e}")
+                await db.approve_join_requests(approved_ids)
             
             await bot.send_message(user_id, "✅ Thank you for completing the onboarding! Welcome to our community.")
             
@@ -752,8 +835,8 @@ async def send_question(user_id: int, question: dict):
             options = question.get('options', '')
             if options:
                 try:
-                    options_list = json.loads(options) if options.startswith('[') else options.split(',')
-                except (json.JSONDecodeError, ValueError):
+                    options_list = orjson.loads(options) if options.startswith('[') else options.split(',')
+                except (orjson.JSONDecodeError, ValueError):
                     options_list = options.split(',')
                 
                 buttons = []
@@ -802,6 +885,7 @@ async def main():
     
     # Initialize database first
     await db.init_db()
+    log_drain_task = asyncio.create_task(db_handler.drain_queue())
     logger.info("Database initialized")
     
     # Get bot token from DB or env
@@ -810,22 +894,37 @@ async def main():
         logger.info("Bot token retrieved")
     except Exception as e:
         logger.error(f"Failed to get bot token: {e}")
+        # Close the connections, or their threads keep the process alive
+        log_drain_task.cancel()
+        await db.close()
         raise
     
     # Initialize bot with token
-    bot = Bot(token=BOT_TOKEN)
+    bot = Bot(token=BOT_TOKEN, session=create_bot_session())
     
     # Handlers are already registered via decorators at module level
     
     # Setup scheduler
     scheduler.add_job(check_scheduled_messages, 'interval', minutes=1)
     scheduler.add_job(send_static_messages, 'interval', minutes=1)  # Check every minute for time-based messages
+    scheduler.add_job(db.optimize, 'interval', minutes=15)  # Keep query planner statistics fresh
+    scheduler.add_job(db.analyze, 'cron', hour=4)  # Full statistics refresh nightly
+    scheduler.add_job(db.prune_logs, 'interval', hours=1, args=[LOG_RETENTION_DAYS])  # Keep the logs table bounded
     scheduler.start()
     logger.info("Scheduler started")
     
     # Start bot
     logger.info("Bot started")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        log_drain_task.cancel()
+        await db_handler.flush_queue()
+        try:
+            await bot.session.close()
+        finally:
+            await db.close()
 
 
 if __name__ == "__main__":
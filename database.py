@@ -1,469 +1,1219 @@
 import aiosqlite
+import asyncio
+import functools
+import logging
 import os
+import random
+import sqlite3
+import time
+import zlib
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 
+# Applied to every connection when it is opened
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=30000",
+)
+
+# Oldest SQLite library the queries run on: UPDATE/INSERT ... RETURNING needs
+# 3.35 (row values, window functions and the trigram tokenizer are older)
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# Bytes the WAL file is truncated to after a checkpoint
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+
+# Append-only log rows and user upserts are queued and written in batches by
+# a background task
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_WINDOW = 0.2  # seconds to wait for more rows before writing a batch
+# Shorter window once a batch holds a write whose caller awaits the commit
+AWAITED_WRITE_WINDOW = 0.01
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds close() waits for in-flight reads to return their connections
+CLOSE_TIMEOUT = 5
+
+# Schema migrations, applied in order. A migration's version is its position
+# in this list (1-based); the applied version is kept in the settings table.
+MIGRATIONS = (
+    ("static_messages", "media_type", "TEXT DEFAULT 'text'"),
+    ("static_messages", "media_file_id", "TEXT"),
+    ("static_messages", "buttons_config", "TEXT"),
+    ("static_messages", "send_time", "TEXT"),
+    ("static_messages", "additional_minutes", "INTEGER DEFAULT 0"),
+    ("users", "invite_code", "TEXT"),
+    ("users", "join_ts", "INTEGER"),
+    ("pyrogram_sessions", "session_type", "TEXT DEFAULT 'user'"),
+    ("pyrogram_sessions", "bot_token", "TEXT"),
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Tables, created in one script. Columns added later live in MIGRATIONS, so
+# indexes on them go in SCHEMA_INDEXES, which runs after the migrations.
+SCHEMA_TABLES = """
+    -- Users table
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER UNIQUE NOT NULL,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_banned INTEGER DEFAULT 0,
+        join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        join_ts INTEGER
+    );
+
+    -- Row counts kept by triggers, so unfiltered counts skip the table scan
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE TRIGGER IF NOT EXISTS users_count_ai AFTER INSERT ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users_total';
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_count_ad AFTER DELETE ON users BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'users_total';
+    END;
+
+    -- Messages table
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        html_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Scheduled messages table
+    CREATE TABLE IF NOT EXISTS scheduled_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        html_text TEXT,
+        scheduled_time TIMESTAMP NOT NULL,
+        is_sent INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Static messages table (messages for first N days)
+    CREATE TABLE IF NOT EXISTS static_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day_number INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        html_text TEXT,
+        media_type TEXT DEFAULT 'text',
+        media_file_id TEXT,
+        buttons_config TEXT,
+        send_time TEXT,
+        additional_minutes INTEGER DEFAULT 0,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- User actions/statistics table
+    CREATE TABLE IF NOT EXISTS user_actions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        action_type TEXT NOT NULL,
+        action_data TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+
+    -- Static message sent tracking table
+    CREATE TABLE IF NOT EXISTS static_messages_sent (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        static_message_id INTEGER NOT NULL,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (static_message_id) REFERENCES static_messages(id),
+        UNIQUE(user_id, static_message_id)
+    );
+
+    -- Settings table
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Logs table for both bot and admin panel
+    CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        level TEXT NOT NULL,
+        source TEXT NOT NULL,
+        message TEXT NOT NULL,
+        details TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Admin credentials table
+    CREATE TABLE IF NOT EXISTS admin_credentials (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Bot menu structure table
+    CREATE TABLE IF NOT EXISTS bot_menu (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        button_name TEXT NOT NULL,
+        button_order INTEGER NOT NULL,
+        button_type TEXT NOT NULL,
+        action_value TEXT,
+        inline_buttons TEXT,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Pressed buttons are matched against the bot's cached menu, so the
+    -- by-name lookup index is no longer needed
+    DROP INDEX IF EXISTS idx_menu_button_name;
+
+    -- Sessions table for persistent login
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_token TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Join requests table
+    CREATE TABLE IF NOT EXISTS join_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        status TEXT DEFAULT 'pending',
+        request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_date TIMESTAMP,
+        UNIQUE(user_id, chat_id)
+    );
+
+    -- Status filter plus newest-first (request_date, id) ordering for the
+    -- requests page and the keyset-paged bulk loops, so pending rows are
+    -- read in order with no sort; replaces the older status-only and
+    -- (status, request_date) indexes
+    DROP INDEX IF EXISTS idx_join_requests_status;
+    DROP INDEX IF EXISTS idx_join_requests_status_date;
+    CREATE INDEX IF NOT EXISTS idx_join_requests_status_date_id ON join_requests(status, request_date DESC, id DESC);
+
+    -- Pyrogram sessions table
+    CREATE TABLE IF NOT EXISTS pyrogram_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_name TEXT UNIQUE NOT NULL,
+        phone_number TEXT NOT NULL,
+        api_id INTEGER NOT NULL,
+        api_hash TEXT NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        last_check TIMESTAMP,
+        user_info TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Invite links table
+    CREATE TABLE IF NOT EXISTS invite_links (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Channel invite links table (Telegram channel invite links)
+    CREATE TABLE IF NOT EXISTS channel_invite_links (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        session_name TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        channel_title TEXT,
+        channel_username TEXT,
+        invite_link TEXT NOT NULL,
+        name TEXT NOT NULL,
+        expire_date INTEGER,
+        member_limit INTEGER,
+        creates_join_request INTEGER DEFAULT 0,
+        is_primary INTEGER DEFAULT 0,
+        is_revoked INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (session_id) REFERENCES pyrogram_sessions(id)
+    );
+
+    -- Questions table for user onboarding questions
+    CREATE TABLE IF NOT EXISTS user_questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question_text TEXT NOT NULL,
+        question_type TEXT NOT NULL,
+        options TEXT,
+        is_required INTEGER DEFAULT 1,
+        order_number INTEGER NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- User answers table to store responses
+    CREATE TABLE IF NOT EXISTS user_answers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        answer_text TEXT NOT NULL,
+        answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (question_id) REFERENCES user_questions(id)
+    );
+
+    -- User onboarding state table to track progress
+    CREATE TABLE IF NOT EXISTS user_onboarding_state (
+        user_id INTEGER PRIMARY KEY,
+        current_question_id INTEGER,
+        static_messages_completed INTEGER DEFAULT 0,
+        onboarding_started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        onboarding_completed_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+"""
+
+# Indexes for the hot filters and orderings (user list, ban status,
+# activity, unsent scheduled messages, actions, active static messages,
+# log viewer, session cleanup)
+SCHEMA_INDEXES = """
+    -- join_ts is the join time as a unix epoch, so the scheduler can do
+    -- integer day math instead of parsing join_date for every user
+    CREATE INDEX IF NOT EXISTS idx_users_join_ts ON users(join_ts);
+    CREATE INDEX IF NOT EXISTS idx_users_join ON users(join_date DESC);
+    CREATE INDEX IF NOT EXISTS idx_users_banned_join ON users(is_banned, join_date DESC);
+    -- Covers every column get_statistics aggregates, so its one pass reads
+    -- this narrow index instead of the users table; replaces the older
+    -- last_activity-only index
+    DROP INDEX IF EXISTS idx_users_last_activity;
+    CREATE INDEX IF NOT EXISTS idx_users_activity_banned ON users(last_activity, is_banned);
+    -- Partial index: only unsent messages, so the scheduler's poll stays
+    -- proportional to what's pending; replaces the older full
+    -- (is_sent, scheduled_time) index
+    DROP INDEX IF EXISTS idx_sched_pending;
+    CREATE INDEX IF NOT EXISTS idx_sched_unsent ON scheduled_messages(scheduled_time) WHERE is_sent = 0;
+    CREATE INDEX IF NOT EXISTS idx_actions_user ON user_actions(user_id, created_at DESC);
+    -- action_type rides along so the per-type counts over a time range
+    -- are answered from the index alone; replaces idx_actions_created
+    DROP INDEX IF EXISTS idx_actions_created;
+    CREATE INDEX IF NOT EXISTS idx_actions_created_type ON user_actions(created_at DESC, action_type);
+    CREATE INDEX IF NOT EXISTS idx_static_active_day ON static_messages(is_active, day_number);
+    CREATE INDEX IF NOT EXISTS idx_logs_created ON logs(created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_logs_src_lvl_ts ON logs(source, level, created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_logs_lvl_ts ON logs(level, created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at);
+"""
+
+# Full-text index over user names for admin search. The trigram tokenizer
+# keeps the old substring (LIKE '%term%') semantics.
+SCHEMA_USERS_FTS = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, first_name, last_name,
+        content='users', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, username, first_name, last_name)
+        VALUES (new.id, new.username, new.first_name, new.last_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name)
+        VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+    END;
+    -- The add_user upsert rewrites the name columns with the same values
+    -- whenever it touches last_activity, so only reindex real changes;
+    -- dropped first so databases with the unguarded trigger pick this up
+    DROP TRIGGER IF EXISTS users_fts_au;
+    CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, first_name, last_name ON users
+    WHEN old.username IS NOT new.username OR old.first_name IS NOT new.first_name
+        OR old.last_name IS NOT new.last_name
+    BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name)
+        VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+        INSERT INTO users_fts(rowid, username, first_name, last_name)
+        VALUES (new.id, new.username, new.first_name, new.last_name);
+    END;
+"""
+
+# Same for the join requests page search, which also matches user ids.
+# Upserts from repeated requests rewrite the name columns with the same
+# values, so the update trigger only reindexes rows that really changed.
+SCHEMA_JOIN_REQUESTS_FTS = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS join_requests_fts USING fts5(
+        user_id, username, first_name, last_name,
+        content='join_requests', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS join_requests_fts_ai AFTER INSERT ON join_requests BEGIN
+        INSERT INTO join_requests_fts(rowid, user_id, username, first_name, last_name)
+        VALUES (new.id, new.user_id, new.username, new.first_name, new.last_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS join_requests_fts_ad AFTER DELETE ON join_requests BEGIN
+        INSERT INTO join_requests_fts(join_requests_fts, rowid, user_id, username, first_name, last_name)
+        VALUES ('delete', old.id, old.user_id, old.username, old.first_name, old.last_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS join_requests_fts_au AFTER UPDATE OF user_id, username, first_name, last_name ON join_requests
+    WHEN old.user_id IS NOT new.user_id OR old.username IS NOT new.username
+        OR old.first_name IS NOT new.first_name OR old.last_name IS NOT new.last_name
+    BEGIN
+        INSERT INTO join_requests_fts(join_requests_fts, rowid, user_id, username, first_name, last_name)
+        VALUES ('delete', old.id, old.user_id, old.username, old.first_name, old.last_name);
+        INSERT INTO join_requests_fts(rowid, user_id, username, first_name, last_name)
+        VALUES (new.id, new.user_id, new.username, new.first_name, new.last_name);
+    END;
+"""
+
+# Stored in PRAGMA user_version once init_db has applied the schema above.
+# Any change to the DDL or the migrations changes it, so startups with an
+# up to date database skip the DDL entirely.
+SCHEMA_FINGERPRINT = zlib.crc32(
+    repr((SCHEMA_TABLES, SCHEMA_INDEXES, SCHEMA_USERS_FTS, SCHEMA_JOIN_REQUESTS_FTS, MIGRATIONS)).encode()
+) & 0x7FFFFFFF
+
+# Read-only connections kept next to the single writer connection
+DB_READERS = min(4, max(2, os.cpu_count() or 2))
+
+# Seconds before cached settings are reloaded, so changes made by the other
+# process (bot vs admin panel) show up
+SETTINGS_CACHE_TTL = 30
+
+# Same for the static messages and bot menu lists, which the bot reads on
+# every tick and the admin panel edits
+CONTENT_CACHE_TTL = 30
+
+# Rows sampled per index by ANALYZE
+ANALYZE_ROW_LIMIT = 1000
+
+# Expired sessions deleted per transaction by cleanup_expired_sessions
+SESSION_CLEANUP_CHUNK = 1000
+
+# Old log rows deleted per transaction by prune_logs, and free pages
+# released afterwards (databases created with auto_vacuum=INCREMENTAL)
+LOG_PRUNE_CHUNK = 5000
+INCREMENTAL_VACUUM_PAGES = 1000
+
+# Rows fetched per round trip when streaming list results
+ROW_CHUNK_SIZE = 256
+
+# Statements on the hot write paths. Keeping each as a single constant means
+# every call hits the connection's prepared statement cache and batched rows
+# for the same statement are grouped into one executemany.
+_SQL_ADD_USER = """
+    INSERT INTO users (user_id, username, first_name, last_name, invite_code, join_ts)
+    VALUES (?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        last_activity = CURRENT_TIMESTAMP
+    -- Returning users with unchanged names only touch last_activity
+    -- every few minutes, so repeated /start doesn't write a page
+    WHERE users.username IS NOT excluded.username
+        OR users.first_name IS NOT excluded.first_name
+        OR users.last_name IS NOT excluded.last_name
+        OR users.last_activity < datetime('now', '-5 minutes')
+"""
+
+_SQL_LOG_ACTION = """
+    INSERT INTO user_actions (user_id, action_type, action_data)
+    VALUES (?, ?, ?)
+"""
+
+_SQL_ADD_LOG = """
+    INSERT INTO logs (level, source, message, details)
+    VALUES (?, ?, ?, ?)
+"""
+
+_SQL_ADD_JOIN_REQUEST = """
+    INSERT INTO join_requests (user_id, chat_id, username, first_name, last_name, status)
+    VALUES (?, ?, ?, ?, ?, 'pending')
+    ON CONFLICT(user_id, chat_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        status = 'pending',
+        request_date = CURRENT_TIMESTAMP,
+        processed_date = NULL
+"""
+
+# Join request keys checked per query by add_join_requests_many
+# (two bound parameters each, well under SQLite's variable limit)
+JOIN_REQUEST_KEY_CHUNK = 500
+
+# Ids bound per SELECT ... WHERE id IN (...) by get_join_requests_by_ids
+JOIN_REQUEST_ID_CHUNK = 900
+
+# Returns a row only when this call inserted the mark, i.e. claimed the pair
+_SQL_MARK_STATIC_SENT = """
+    INSERT OR IGNORE INTO static_messages_sent (user_id, static_message_id)
+    VALUES (?, ?)
+    RETURNING 1
+"""
+
+# Id-list statement, filled in by _id_list_sql. Only the columns the approve/
+# deny handlers act on, not the name fields and dates
+_SQL_JOIN_REQUESTS_BY_IDS = "SELECT id, user_id, chat_id, status FROM join_requests WHERE id IN ({placeholders})"
+
+_SQL_SET_JOIN_REQUEST_STATUS = """
+    UPDATE join_requests 
+    SET status = ?, processed_date = ? 
+    WHERE id = ?
+"""
+
+
+def retry_on_busy(attempts: int = 5, base: float = 0.02):
+    """Retry a database coroutine while SQLite reports the database as locked
+    
+    busy_timeout covers most lock waits; this handles the cases SQLite returns
+    SQLITE_BUSY immediately (e.g. a stale WAL snapshot) with jittered backoff.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except aiosqlite.OperationalError as e:
+                    message = str(e)
+                    if attempt == attempts - 1 or ('locked' not in message and 'busy' not in message):
+                        raise
+                    await asyncio.sleep(base * (2 ** attempt) * (1 + random.random()))
+        return wrapper
+    return decorator
+
+
+# Stores a bound JSON value in SQLite's compact json() form, so the bot's
+# markup cache (keyed on the raw string) sees one key per button config and
+# parses no whitespace; anything that isn't valid JSON is stored unchanged
+_SQL_COMPACT_JSON = "(SELECT CASE WHEN json_valid(v) THEN json(v) ELSE v END FROM (SELECT ? AS v))"
+
+# Filtered list queries. {where} is filled by _filtered_sql from the clauses
+# built by Database._user_filters/_log_filters.
+#
+# The page queries count and order only the id and sort key, which the
+# sort indexes cover, then read full rows for the page alone. Selecting *
+# there would load every matching row to feed the window count.
+_SQL_USERS_LIST = "SELECT * FROM users{where} ORDER BY join_date DESC, id DESC LIMIT ? OFFSET ?"
+_SQL_USERS_PAGE = """
+    SELECT users.*, page._total FROM (
+        SELECT id, join_date, COUNT(*) OVER () AS _total FROM users{where}
+        ORDER BY join_date DESC, id DESC LIMIT ? OFFSET ?
+    ) page
+    JOIN users ON users.id = page.id
+    ORDER BY page.join_date DESC, page.id DESC
+"""
+_SQL_USERS_COUNT = "SELECT COUNT(*) FROM users{where}"
+_SQL_LOGS_LIST = "SELECT * FROM logs{where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+_SQL_LOGS_PAGE = """
+    SELECT logs.*, page._total FROM (
+        SELECT id, created_at, COUNT(*) OVER () AS _total FROM logs{where}
+        ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?
+    ) page
+    JOIN logs ON logs.id = page.id
+    ORDER BY page.created_at DESC, page.id DESC
+"""
+_SQL_LOGS_COUNT = "SELECT COUNT(*) FROM logs{where}"
+
+
+def _fts_phrase(search: str) -> str:
+    """Quote a search term as one FTS5 phrase, so it matches as a plain substring"""
+    return '"' + search.replace('"', '""') + '"'
+
+
+def _utc_timestamp() -> str:
+    """The current UTC time in CURRENT_TIMESTAMP's text format"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
+def _id_chunks(ids: list):
+    """Split ids into JOIN_REQUEST_ID_CHUNK-sized chunks padded to a power of two
+    
+    Repeating the last id doesn't change what IN (...) matches, and the
+    padding keeps each id-list statement to a dozen or so distinct texts
+    instead of one per list length, so they stay in the statement cache.
+    """
+    for start in range(0, len(ids), JOIN_REQUEST_ID_CHUNK):
+        chunk = list(ids[start:start + JOIN_REQUEST_ID_CHUNK])
+        size = min(1 << (len(chunk) - 1).bit_length(), JOIN_REQUEST_ID_CHUNK)
+        yield chunk + chunk[-1:] * (size - len(chunk))
+
+
+@functools.lru_cache(maxsize=None)
+def _id_list_sql(template: str, count: int) -> str:
+    """Fill an id-list template with count placeholders, built once per size"""
+    return template.format(placeholders=", ".join("?" * count))
+
+
+@functools.lru_cache(maxsize=None)
+def _filtered_sql(template: str, clauses: tuple) -> str:
+    """Fill a filtered query template; each filter combination is built once
+    
+    There are only a handful of combinations, so callers get back the same
+    string object every time and the statement cache always hits.
+    """
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return template.format(where=where)
+
+
+class _TransactionConnection:
+    """Connection wrapper handed out inside Database.transaction()
+    
+    Commits from the write methods become no-ops so the whole block is
+    committed once when it exits.
+    """
+    
+    def __init__(self, db):
+        self._db = db
+    
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+    
+    async def commit(self):
+        pass
+
+
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        self._db = None
+        # Read-only connections, handed out through the _readers queue
+        self._reader_conns = []
+        self._readers = None
+        self._connect_lock = asyncio.Lock()
+        # Serializes write transactions on the shared connection so one
+        # coroutine's commit/rollback can't cover another's statements
+        self._write_lock = asyncio.Lock()
+        # Connection and owning task of the open transaction() block, if any
+        self._tx = None
+        self._tx_task = None
+        # Pending (sql, params) rows and the task that writes them in batches
+        self._write_queue = asyncio.Queue()
+        self._write_worker_task = None
+        # Cached settings table; set_setting writes through, and other
+        # processes' changes are picked up after SETTINGS_CACHE_TTL
+        self._settings = None
+        self._settings_loaded_at = 0.0
+        # Cached static message / bot menu lists by name -> (loaded_at, rows).
+        # Mutators clear it and bump _cache_gen, so a load that raced with a
+        # write isn't stored
+        self._content_cache = {}
+        self._cache_gen = 0
+        # Admin panel sessions by token; only the admin process uses them, so
+        # this stays in sync through the session methods
+        self._sessions = None
+        # Set by init_db once the users_fts search index is available
+        self._fts_enabled = False
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
-    async def init_db(self):
-        """Initialize database tables"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    is_banned INTEGER DEFAULT 0,
-                    join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Messages table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    text TEXT NOT NULL,
-                    html_text TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Scheduled messages table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS scheduled_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    text TEXT NOT NULL,
-                    html_text TEXT,
-                    scheduled_time TIMESTAMP NOT NULL,
-                    is_sent INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Static messages table (messages for first N days)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS static_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    day_number INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    html_text TEXT,
-                    media_type TEXT DEFAULT 'text',
-                    media_file_id TEXT,
-                    buttons_config TEXT,
-                    send_time TEXT,
-                    additional_minutes INTEGER DEFAULT 0,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    async def _open_connection(self, read_only: bool = False):
+        """Open a long-lived connection and apply PRAGMA tuning"""
+        # Keep plenty of prepared statements around on the long-lived connection
+        db = await aiosqlite.connect(self.db_path, cached_statements=256)
+        if not read_only:
+            # Only takes effect on a new, empty database: pages freed by
+            # prune_logs can then be returned to the filesystem
+            await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL is stored in the database file, so setting it on the
+            # writer covers every connection opened after it
+            await db.execute("PRAGMA journal_mode=WAL")
+            # A bulk approve or log prune can grow the WAL well past its
+            # usual size; truncate it back after checkpoints instead of
+            # keeping the file at its high-water mark
+            await db.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT}")
+        for pragma in SQLITE_PRAGMAS:
+            await db.execute(pragma)
+        if read_only:
+            await db.execute("PRAGMA query_only=1")
+        db.row_factory = aiosqlite.Row
+        return db
+    
+    async def connect(self):
+        """Open the writer connection and the pool of reader connections"""
+        async with self._connect_lock:
+            if self._db is not None:
+                return
+            if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+                # Fail here rather than on the first RETURNING query
+                raise RuntimeError(
+                    f"SQLite {sqlite3.sqlite_version} is too old, "
+                    f"{'.'.join(map(str, MIN_SQLITE_VERSION))} or newer is required"
                 )
-            """)
-            
-            # User actions/statistics table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_actions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    action_type TEXT NOT NULL,
-                    action_data TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Static message sent tracking table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS static_messages_sent (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    static_message_id INTEGER NOT NULL,
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (static_message_id) REFERENCES static_messages(id),
-                    UNIQUE(user_id, static_message_id)
-                )
-            """)
-            
-            # Settings table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Logs table for both bot and admin panel
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    level TEXT NOT NULL,
-                    source TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    details TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Admin credentials table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS admin_credentials (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Bot menu structure table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS bot_menu (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    button_name TEXT NOT NULL,
-                    button_order INTEGER NOT NULL,
-                    button_type TEXT NOT NULL,
-                    action_value TEXT,
-                    inline_buttons TEXT,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Sessions table for persistent login
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_token TEXT PRIMARY KEY,
-                    username TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Join requests table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS join_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    status TEXT DEFAULT 'pending',
-                    request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_date TIMESTAMP,
-                    UNIQUE(user_id, chat_id)
-                )
-            """)
-            
-            # Create index on status column for better query performance
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_join_requests_status 
-                ON join_requests(status)
-            """)
-            
-            # Pyrogram sessions table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS pyrogram_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_name TEXT UNIQUE NOT NULL,
-                    phone_number TEXT NOT NULL,
-                    api_id INTEGER NOT NULL,
-                    api_hash TEXT NOT NULL,
-                    is_active INTEGER DEFAULT 1,
-                    last_check TIMESTAMP,
-                    user_info TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Invite links table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS invite_links (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    code TEXT UNIQUE NOT NULL,
-                    name TEXT NOT NULL,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Channel invite links table (Telegram channel invite links)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS channel_invite_links (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id INTEGER NOT NULL,
-                    session_name TEXT NOT NULL,
-                    channel_id INTEGER NOT NULL,
-                    channel_title TEXT,
-                    channel_username TEXT,
-                    invite_link TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    expire_date INTEGER,
-                    member_limit INTEGER,
-                    creates_join_request INTEGER DEFAULT 0,
-                    is_primary INTEGER DEFAULT 0,
-                    is_revoked INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (session_id) REFERENCES pyrogram_sessions(id)
-                )
-            """)
-            
-            # Migration: Add new columns to static_messages if they don't exist
+            # The writer goes first so WAL mode is in place before readers attach
+            self._db = await self._open_connection()
+            self._reader_conns = [
+                await self._open_connection(read_only=True) for _ in range(DB_READERS)
+            ]
+            self._readers = asyncio.Queue()
+            for reader in self._reader_conns:
+                self._readers.put_nowait(reader)
+    
+    async def close(self):
+        """Flush queued writes and close all connections"""
+        if self._write_worker_task is not None:
+            # None tells the worker to write what's left and stop
+            self._write_queue.put_nowait(None)
+            await self._write_worker_task
+            self._write_worker_task = None
+        if self._readers is not None:
+            # Let in-flight reads hand their connections back first
             try:
-                # Check if columns exist
-                async with db.execute("PRAGMA table_info(static_messages)") as cursor:
-                    columns = await cursor.fetchall()
-                    column_names = [col[1] for col in columns]
-                    
-                    if 'media_type' not in column_names:
-                        await db.execute("ALTER TABLE static_messages ADD COLUMN media_type TEXT DEFAULT 'text'")
-                    if 'media_file_id' not in column_names:
-                        await db.execute("ALTER TABLE static_messages ADD COLUMN media_file_id TEXT")
-                    if 'buttons_config' not in column_names:
-                        await db.execute("ALTER TABLE static_messages ADD COLUMN buttons_config TEXT")
-                    if 'send_time' not in column_names:
-                        await db.execute("ALTER TABLE static_messages ADD COLUMN send_time TEXT")
-                    if 'additional_minutes' not in column_names:
-                        await db.execute("ALTER TABLE static_messages ADD COLUMN additional_minutes INTEGER DEFAULT 0")
-            except Exception as e:
-                # Log migration errors for debugging
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Migration warning (may be expected if columns already exist): {e}")
-            
-            # Migration: Add invite_code column to users table if it doesn't exist
+                await asyncio.wait_for(self._drain_readers(), CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Closing database with reads still in progress")
+        for reader in self._reader_conns:
+            await reader.close()
+        self._reader_conns = []
+        self._readers = None
+        if self._db is not None:
+            # Wait for a write transaction in progress to finish
+            async with self._write_lock:
+                # SQLite recommends this before closing long-lived
+                # connections; it also covers the admin panel, which has
+                # no periodic optimize job
+                await self._db.execute("PRAGMA optimize")
+                await self._db.close()
+                self._db = None
+    
+    async def _drain_readers(self):
+        """Take every reader connection back out of the pool"""
+        for _ in self._reader_conns:
+            await self._readers.get()
+    
+    async def optimize(self):
+        """Let SQLite refresh query planner statistics where they went stale"""
+        async with self._write() as db:
+            await db.execute("PRAGMA optimize")
+    
+    async def _analyze(self, db):
+        """Gather planner statistics for every table and index"""
+        # Sample at most ~1000 rows per index so this stays fast on big tables
+        await db.execute(f"PRAGMA analysis_limit={ANALYZE_ROW_LIMIT}")
+        await db.execute("ANALYZE")
+        await db.commit()
+    
+    async def analyze(self):
+        """Refresh planner statistics for all tables (run nightly)"""
+        async with self._write() as db:
+            await self._analyze(db)
+    
+    @asynccontextmanager
+    async def _connection(self):
+        """Yield the shared connection, rolling back a failed transaction"""
+        if self._db is None:
+            await self.connect()
+        try:
+            yield self._db
+        except BaseException:
+            # Cancellation too: a transaction left open here would be
+            # committed by the next writer as part of its own
+            if self._db.in_transaction:
+                await self._db.rollback()
+            raise
+    
+    @asynccontextmanager
+    async def _read(self):
+        """Borrow a read-only connection from the pool
+        
+        Under WAL readers don't block each other or the writer, so admin
+        pages and scheduler reads run alongside queued writes.
+        """
+        if self._db is None:
+            await self.connect()
+        readers = self._readers
+        db = await readers.get()
+        try:
+            yield db
+        finally:
+            readers.put_nowait(db)
+    
+    @asynccontextmanager
+    async def _write(self):
+        """Yield the shared connection while holding the write lock"""
+        if self._tx is not None and self._tx_task is asyncio.current_task():
+            # Already inside transaction() in this task, which holds the lock
+            yield self._tx
+            return
+        async with self._write_lock:
+            async with self._connection() as db:
+                yield db
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """Run several write methods in one transaction with a single commit
+        
+        Usage: async with db.transaction(): ... The block is rolled back if it
+        raises or is cancelled. Reads inside the block use the reader pool and don't see its
+        uncommitted changes.
+        """
+        if self._tx is not None and self._tx_task is asyncio.current_task():
+            yield self._tx
+            return
+        async with self._write_lock:
+            async with self._connection() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                self._tx = _TransactionConnection(db)
+                self._tx_task = asyncio.current_task()
+                try:
+                    yield self._tx
+                    await db.commit()
+                finally:
+                    self._tx = None
+                    self._tx_task = None
+                    # A rolled back block may have written through to the caches
+                    self._settings = None
+                    self._sessions = None
+                    self._invalidate_content_cache()
+    
+    def _enqueue_write(self, sql: str, params: tuple, waiter: asyncio.Future = None):
+        """Queue a single-row write for the background batch writer
+        
+        waiter, if given, is resolved once the write's batch is committed.
+        """
+        if self._write_worker_task is None or self._write_worker_task.done():
+            self._write_worker_task = asyncio.create_task(self._write_worker())
+        self._write_queue.put_nowait((sql, params, waiter))
+    
+    async def _queued_write(self, sql: str, params: tuple):
+        """Queue a single-row write and wait until its batch is committed
+        
+        Concurrent callers within AWAITED_WRITE_WINDOW share one transaction
+        and one commit.
+        """
+        if self._tx is not None and self._tx_task is asyncio.current_task():
+            # The worker would wait on the lock this transaction holds
+            await self._tx.execute(sql, params)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._enqueue_write(sql, params, waiter)
+        await waiter
+    
+    async def _write_worker(self):
+        """Write queued rows in batches, one transaction per batch"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._write_queue.get()
+            if item is None:
+                self._write_queue.task_done()
+                break
+            batch = [item]
+            deadline = loop.time() + WRITE_BATCH_WINDOW
+            while len(batch) < WRITE_BATCH_SIZE:
+                if item[2] is not None:
+                    deadline = min(deadline, loop.time() + AWAITED_WRITE_WINDOW)
+                try:
+                    item = self._write_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    # Wake often enough to notice an awaited write arriving
+                    await asyncio.sleep(min(remaining, AWAITED_WRITE_WINDOW))
+                    continue
+                if item is None:
+                    self._write_queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            error = None
             try:
-                async with db.execute("PRAGMA table_info(users)") as cursor:
-                    columns = await cursor.fetchall()
-                    column_names = [col[1] for col in columns]
-                    
-                    if 'invite_code' not in column_names:
-                        await db.execute("ALTER TABLE users ADD COLUMN invite_code TEXT")
+                await self._write_batch(batch)
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Migration warning for users table: {e}")
-            
-            # Migration: Add session_type and bot_token columns to pyrogram_sessions table if they don't exist
+                error = e
+                logger.error(f"Failed to write {len(batch)} queued rows: {e}")
+            for _, _, waiter in batch:
+                if waiter is not None and not waiter.done():
+                    if error is None:
+                        waiter.set_result(None)
+                    else:
+                        waiter.set_exception(error)
+                self._write_queue.task_done()
+    
+    @retry_on_busy()
+    async def _write_batch(self, batch: list):
+        """Insert a batch of queued rows, grouped by statement"""
+        grouped = {}
+        for sql, params, _ in batch:
+            grouped.setdefault(sql, []).append(params)
+        async with self._write() as db:
+            # One executemany per statement, all committed together; a failed
+            # batch is rolled back so the next writer doesn't commit half of it
+            try:
+                for sql, rows in grouped.items():
+                    await db.executemany(sql, rows)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+    
+    async def _migrate(self, db):
+        """Run the migrations newer than the stored schema_version
+        
+        Returns True if any migration ran.
+        """
+        async with db.execute(
+            "SELECT value FROM settings WHERE key = 'schema_version'"
+        ) as cursor:
+            row = await cursor.fetchone()
+        version = int(row[0]) if row else 0
+        if version >= SCHEMA_VERSION:
+            return False
+        
+        if not db.in_transaction:
+            await db.execute("BEGIN IMMEDIATE")
+        for number, (table, column, definition) in enumerate(MIGRATIONS[version:], version + 1):
             try:
-                async with db.execute("PRAGMA table_info(pyrogram_sessions)") as cursor:
-                    columns = await cursor.fetchall()
-                    column_names = [col[1] for col in columns]
-                    
-                    if 'session_type' not in column_names:
-                        await db.execute("ALTER TABLE pyrogram_sessions ADD COLUMN session_type TEXT DEFAULT 'user'")
-                    if 'bot_token' not in column_names:
-                        await db.execute("ALTER TABLE pyrogram_sessions ADD COLUMN bot_token TEXT")
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
             except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Migration warning for pyrogram_sessions table: {e}")
-            
-            # Questions table for user onboarding questions
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_questions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question_text TEXT NOT NULL,
-                    question_type TEXT NOT NULL,
-                    options TEXT,
-                    is_required INTEGER DEFAULT 1,
-                    order_number INTEGER NOT NULL,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # User answers table to store responses
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_answers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    question_id INTEGER NOT NULL,
-                    answer_text TEXT NOT NULL,
-                    answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (question_id) REFERENCES user_questions(id)
-                )
-            """)
-            
-            # User onboarding state table to track progress
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_onboarding_state (
-                    user_id INTEGER PRIMARY KEY,
-                    current_question_id INTEGER,
-                    static_messages_completed INTEGER DEFAULT 0,
-                    onboarding_started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    onboarding_completed_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            await db.commit()
+                # Tables just created from SCHEMA_TABLES and databases from
+                # before versioning may already have the column
+                if isinstance(e, aiosqlite.OperationalError) and "duplicate column name" in str(e):
+                    continue
+                logger.exception(f"Schema migration {number} ({table}.{column}) failed")
+                raise
+        await db.execute("""
+            INSERT INTO settings (key, value) VALUES ('schema_version', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+        """, (str(SCHEMA_VERSION),))
+        await db.commit()
+        logger.info(f"Database schema migrated from version {version} to {SCHEMA_VERSION}")
+        return True
+    
+    async def _index_names(self, db):
+        """Names of the indexes currently in the schema"""
+        async with db.execute("SELECT name FROM sqlite_master WHERE type = 'index'") as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+    
+    async def init_db(self):
+        """Initialize database tables"""
+        async with self._write() as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                (user_version,) = await cursor.fetchone()
+            if user_version == SCHEMA_FINGERPRINT:
+                # Schema already current; only find out whether FTS is there
+                async with db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+                ) as cursor:
+                    self._fts_enabled = await cursor.fetchone() is not None
+            else:
+                await self._apply_schema(db)
+                await db.execute(f"PRAGMA user_version = {SCHEMA_FINGERPRINT}")
+        
+        # Warm the settings cache so the first handlers don't wait on it
+        await self._load_settings()
+    
+    async def _apply_schema(self, db):
+        """Create tables and indexes, run migrations and one-off backfills"""
+        indexes_before = await self._index_names(db)
+        
+        await db.executescript(SCHEMA_TABLES)
+        
+        # (Re)seed the counters now that their triggers exist
+        await db.execute("INSERT OR REPLACE INTO counters (name, value) SELECT 'users_total', COUNT(*) FROM users")
+        
+        # Store inline button configs saved before minification in
+        # their compact JSON form too
+        await db.execute("""
+            UPDATE bot_menu SET inline_buttons = json(inline_buttons)
+            WHERE json_valid(inline_buttons) AND inline_buttons != json(inline_buttons)
+        """)
+        
+        migrated = await self._migrate(db)
+        
+        await db.executescript(SCHEMA_INDEXES)
+        await db.execute("""
+            UPDATE users SET join_ts = CAST(strftime('%s', join_date) AS INTEGER)
+            WHERE join_ts IS NULL
+        """)
+        
+        try:
+            for fts_table, fts_schema in (
+                ("users_fts", SCHEMA_USERS_FTS),
+                ("join_requests_fts", SCHEMA_JOIN_REQUESTS_FTS),
+            ):
+                async with db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+                ) as cursor:
+                    fts_exists = await cursor.fetchone() is not None
+                await db.executescript(fts_schema)
+                if not fts_exists:
+                    # Index rows that existed before the table was created
+                    await db.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+            self._fts_enabled = True
+        except Exception as e:
+            # SQLite built without FTS5/trigram: search falls back to LIKE
+            logger.warning(f"Full-text search unavailable, using LIKE for user search: {e}")
+            self._fts_enabled = False
+        
+        await db.commit()
+        
+        # Give the planner statistics for the indexes above on a fresh
+        # database and after the schema or the set of indexes changed
+        async with db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ) as cursor:
+            has_stats = await cursor.fetchone() is not None
+        new_indexes = await self._index_names(db) - indexes_before
+        if migrated or new_indexes or not has_stats:
+            await self._analyze(db)
     
     # User operations
     async def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None, invite_code: str = None):
-        """Add or update user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO users (user_id, username, first_name, last_name, invite_code)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET
-                    username = excluded.username,
-                    first_name = excluded.first_name,
-                    last_name = excluded.last_name,
-                    last_activity = CURRENT_TIMESTAMP
-            """, (user_id, username, first_name, last_name, invite_code))
-            await db.commit()
-    
-    async def get_users(self, search: str = None, is_banned: int = None, limit: int = 100, offset: int = 0):
-        """Get users with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = "SELECT * FROM users WHERE 1=1"
-            params = []
-            
-            if search:
-                query += " AND (username LIKE ? OR first_name LIKE ? OR last_name LIKE ?)"
-                search_param = f"%{search}%"
-                params.extend([search_param, search_param, search_param])
-            
-            if is_banned is not None:
-                query += " AND is_banned = ?"
-                params.append(is_banned)
-            
-            query += " ORDER BY join_date DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-            
+        """Add or update user (queued, join storms are written in one transaction)"""
+        # Always queued: the row may have been deleted by the admin process,
+        # and _SQL_ADD_USER already leaves unchanged recent users unwritten
+        self._enqueue_write(_SQL_ADD_USER, (user_id, username, first_name, last_name, invite_code))
+    
+    def _user_search_clause(self, search: str):
+        """Build the WHERE fragment and params for a user name search"""
+        # Trigram matching needs at least 3 characters
+        if self._fts_enabled and len(search) >= 3:
+            return "id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)", [_fts_phrase(search)]
+        search_param = f"%{search}%"
+        return "(username LIKE ? OR first_name LIKE ? OR last_name LIKE ?)", [search_param] * 3
+    
+    async def _iter_rows(self, query: str, params=()):
+        """Yield result rows as dicts, fetching ROW_CHUNK_SIZE rows at a time"""
+        async with self._read() as db:
             async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                # Zipping against the column names read once is cheaper than
+                # dict(row), which looks every key up through the Row
+                names = [column[0] for column in cursor.description]
+                while rows := await cursor.fetchmany(ROW_CHUNK_SIZE):
+                    for row in rows:
+                        yield dict(zip(names, row))
+    
+    async def _fetch_rows(self, query: str, params=()):
+        """Collect _iter_rows into a list"""
+        return [row async for row in self._iter_rows(query, params)]
+    
+    async def _fetch_one(self, query: str, params=()):
+        """Fetch the first result row of a key lookup as a dict, or None if there is none"""
+        async with self._read() as db:
+            # execute_fetchall runs, fetches and drops the cursor in one trip
+            # to the connection thread, where execute/fetchone/close take three
+            rows = await db.execute_fetchall(query, params)
+        if not rows:
+            return None
+        return dict(zip(rows[0].keys(), rows[0]))
+    
+    async def _fetch_page(self, query: str, params=()):
+        """Fetch a page query whose last column is COUNT(*) OVER ()
+        
+        Returns (rows as dicts without the count column, count), or
+        ([], None) when the page is empty.
+        """
+        async with self._read() as db:
+            # One trip to the connection thread, as in _fetch_one
+            rows = await db.execute_fetchall(query, params)
+        if not rows:
+            return [], None
+        names = rows[0].keys()[:-1]
+        return [dict(zip(names, row)) for row in rows], rows[0][-1]
+    
+    async def _fetch_raw(self, query: str, params=()):
+        """Fetch all result rows as sqlite3.Row objects, skipping the dict copy
+        
+        For internal callers that only read columns by name; anything that
+        mutates rows or serializes them to JSON should use _fetch_rows.
+        """
+        async with self._read() as db:
+            return await db.execute_fetchall(query, params)
+    
+    def _user_filters(self, search: str = None, is_banned: int = None, after: tuple = None):
+        """Build the WHERE clauses and params shared by user list queries"""
+        clauses = []
+        params = []
+        
+        if after:
+            # Keyset cursor: (join_date, id) of the last row of the previous page
+            clauses.append("(join_date, id) < (?, ?)")
+            params.extend(after)
+        
+        if search:
+            search_sql, search_params = self._user_search_clause(search)
+            clauses.append(search_sql)
+            params.extend(search_params)
+        
+        if is_banned is not None:
+            clauses.append("is_banned = ?")
+            params.append(is_banned)
+        
+        return tuple(clauses), params
+    
+    async def iter_active_user_ids(self, batch_size: int = 500):
+        """Yield ids of all non-banned users without loading them all at once"""
+        async with self._read() as db:
+            async with db.execute("SELECT user_id FROM users WHERE is_banned = 0") as cursor:
+                while rows := await cursor.fetchmany(batch_size):
+                    for row in rows:
+                        yield row[0]
+    
+    async def get_users_page(self, search: str = None, is_banned: int = None, limit: int = 100, offset: int = 0, after: tuple = None):
+        """Get a page of users and the number of matching users in one query
+        
+        Pass `after` (join_date, id) of the previous page's last row to seek
+        straight to the next page instead of skipping `offset` rows. The
+        count covers every row matching the filters, or with `after`, only
+        the rows from the cursor on.
+        """
+        clauses, params = self._user_filters(search, is_banned, after)
+        if not clauses:
+            # Unfiltered: the users_total counter replaces the window count,
+            # so the query stops after the page instead of counting every row
+            rows = await self._fetch_rows(_filtered_sql(_SQL_USERS_LIST, clauses), (limit, offset))
+            return rows, await self.get_user_count()
+        if after:
+            offset = 0
+        query = _filtered_sql(_SQL_USERS_PAGE, clauses)
+        rows, total = await self._fetch_page(query, (*params, limit, offset))
+        
+        if not rows:
+            # An offset past the end returns no rows to carry the count
+            total = await self.get_user_count(search, is_banned) if offset else 0
+        return rows, total
     
     async def get_user_count(self, search: str = None, is_banned: int = None):
         """Get total user count with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            query = "SELECT COUNT(*) FROM users WHERE 1=1"
-            params = []
-            
-            if search:
-                query += " AND (username LIKE ? OR first_name LIKE ? OR last_name LIKE ?)"
-                search_param = f"%{search}%"
-                params.extend([search_param, search_param, search_param])
-            
-            if is_banned is not None:
-                query += " AND is_banned = ?"
-                params.append(is_banned)
-            
-            async with db.execute(query, params) as cursor:
+        async with self._read() as db:
+            clauses, params = self._user_filters(search, is_banned)
+            if not clauses:
+                async with db.execute("SELECT value FROM counters WHERE name = 'users_total'") as cursor:
+                    result = await cursor.fetchone()
+                    return result[0]
+            
+            async with db.execute(_filtered_sql(_SQL_USERS_COUNT, clauses), params) as cursor:
                 result = await cursor.fetchone()
                 return result[0]
     
+    async def user_exists(self, user_id: int):
+        """Check if a user is known to the bot"""
+        async with self._read() as db:
+            async with db.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                return await cursor.fetchone() is not None
+    
+    async def get_user_id_by_username(self, username: str):
+        """Get a user's id by their Telegram username"""
+        async with self._read() as db:
+            async with db.execute("SELECT user_id FROM users WHERE username = ?", (username,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    
     async def ban_user(self, user_id: int):
         """Ban a user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("UPDATE users SET is_banned = 1 WHERE user_id = ?", (user_id,))
             await db.commit()
     
     async def unban_user(self, user_id: int):
         """Unban a user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("UPDATE users SET is_banned = 0 WHERE user_id = ?", (user_id,))
             await db.commit()
     
     async def delete_user(self, user_id: int):
         """Delete a user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
             await db.commit()
     
     # User actions/statistics
     async def log_action(self, user_id: int, action_type: str, action_data: str = None):
-        """Log user action"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO user_actions (user_id, action_type, action_data)
-                VALUES (?, ?, ?)
-            """, (user_id, action_type, action_data))
+        """Log user action (queued, written in the background)"""
+        self._enqueue_write(_SQL_LOG_ACTION, (user_id, action_type, action_data))
+    
+    @retry_on_busy()
+    async def log_actions_many(self, rows: list):
+        """Log many (user_id, action_type, action_data) actions at once"""
+        async with self._write() as db:
+            await db.executemany(_SQL_LOG_ACTION, rows)
             await db.commit()
     
     async def get_statistics(self):
         """Get statistics"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Total users
-            async with db.execute("SELECT COUNT(*) as total FROM users") as cursor:
-                total_users = (await cursor.fetchone())[0]
-            
-            # Banned users
-            async with db.execute("SELECT COUNT(*) as total FROM users WHERE is_banned = 1") as cursor:
-                banned_users = (await cursor.fetchone())[0]
-            
-            # Active users (activity in last 7 days)
-            async with db.execute("""
-                SELECT COUNT(*) as total FROM users 
-                WHERE last_activity >= datetime('now', '-7 days')
-            """) as cursor:
-                active_users = (await cursor.fetchone())[0]
-            
-            # Recent actions
-            async with db.execute("""
-                SELECT ua.*, u.username, u.first_name 
-                FROM user_actions ua
-                LEFT JOIN users u ON ua.user_id = u.user_id
-                ORDER BY ua.created_at DESC
-                LIMIT 100
-            """) as cursor:
-                rows = await cursor.fetchall()
-                recent_actions = [dict(row) for row in rows]
+        async with self._read() as db:
+            # Total, banned and active (last 7 days) users in one scan, plus
+            # recent actions and per-type action counts for the last day; all
+            # are queued at once and each is a single execute+fetch hop on the
+            # connection thread
+            counts, action_rows, type_rows = await asyncio.gather(
+                db.execute_fetchall("""
+                    SELECT
+                        COUNT(*) AS total,
+                        COALESCE(SUM(is_banned = 1), 0) AS banned,
+                        COALESCE(SUM(last_activity >= datetime('now', '-7 days')), 0) AS active
+                    FROM users
+                """),
+                db.execute_fetchall("""
+                    SELECT ua.*, u.username, u.first_name 
+                    FROM user_actions ua
+                    LEFT JOIN users u ON ua.user_id = u.user_id
+                    ORDER BY ua.created_at DESC
+                    LIMIT 100
+                """),
+                db.execute_fetchall("""
+                    SELECT action_type, COUNT(*) AS count
+                    FROM user_actions
+                    WHERE created_at >= datetime('now', '-1 day')
+                    GROUP BY action_type
+                    ORDER BY count DESC
+                """)
+            )
+            total_users, banned_users, active_users = counts[0]
+            if action_rows:
+                names = action_rows[0].keys()
+                recent_actions = [dict(zip(names, row)) for row in action_rows]
+            else:
+                recent_actions = []
             
             return {
                 "total_users": total_users,
                 "banned_users": banned_users,
                 "active_users": active_users,
-                "recent_actions": recent_actions
+                "recent_actions": recent_actions,
+                "actions_24h": {action_type: count for action_type, count in type_rows}
             }
     
     # Scheduled messages
     async def add_scheduled_message(self, text: str, html_text: str, scheduled_time: str):
-        """Add scheduled message"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        """Add scheduled message and return its id"""
+        async with self._write() as db:
+            async with db.execute("""
                 INSERT INTO scheduled_messages (text, html_text, scheduled_time)
                 VALUES (?, ?, ?)
-            """, (text, html_text, scheduled_time))
+                RETURNING id
+            """, (text, html_text, scheduled_time)) as cursor:
+                message_id = (await cursor.fetchone())[0]
             await db.commit()
+            return message_id
     
     async def get_scheduled_messages(self):
         """Get all scheduled messages"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM scheduled_messages 
-                ORDER BY scheduled_time ASC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows("""
+            SELECT * FROM scheduled_messages 
+            ORDER BY scheduled_time ASC
+        """)
     
     async def get_pending_scheduled_messages(self):
         """Get pending scheduled messages"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM scheduled_messages 
-                WHERE is_sent = 0 AND scheduled_time <= datetime('now')
-                ORDER BY scheduled_time ASC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows("""
+            SELECT * FROM scheduled_messages 
+            WHERE is_sent = 0 AND scheduled_time <= datetime('now')
+            ORDER BY scheduled_time ASC
+        """)
     
     async def mark_scheduled_message_sent(self, message_id: int):
         """Mark scheduled message as sent"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 UPDATE scheduled_messages SET is_sent = 1 WHERE id = ?
             """, (message_id,))
@@ -471,36 +1221,57 @@ class Database:
     
     async def delete_scheduled_message(self, message_id: int):
         """Delete scheduled message"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM scheduled_messages WHERE id = ?", (message_id,))
             await db.commit()
     
     # Static messages
     async def add_static_message(self, day_number: int, text: str, html_text: str, media_type: str = 'text', media_file_id: str = None, buttons_config: str = None, send_time: str = None, additional_minutes: int = 0):
-        """Add static message"""
+        """Add static message and return its id"""
         # Normalize file_id: strip whitespace and convert empty strings to None
         if media_file_id is not None and isinstance(media_file_id, str):
             media_file_id = media_file_id.strip()
             if not media_file_id:
                 media_file_id = None
         
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        async with self._write() as db:
+            async with db.execute("""
                 INSERT INTO static_messages (day_number, text, html_text, media_type, media_file_id, buttons_config, send_time, additional_minutes)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (day_number, text, html_text, media_type, media_file_id, buttons_config, send_time, additional_minutes))
+                RETURNING id
+            """, (day_number, text, html_text, media_type, media_file_id, buttons_config, send_time, additional_minutes)) as cursor:
+                message_id = (await cursor.fetchone())[0]
             await db.commit()
+            self._invalidate_content_cache()
+            return message_id
+    
+    async def _cached_rows(self, name: str, loader):
+        """Return the cached result of loader(), reloading it once stale"""
+        now = time.monotonic()
+        cached = self._content_cache.get(name)
+        if cached is not None and now - cached[0] <= CONTENT_CACHE_TTL:
+            return list(cached[1])
+        generation = self._cache_gen
+        rows = await loader()
+        if generation == self._cache_gen:
+            self._content_cache[name] = (now, rows)
+        return list(rows)
+    
+    def _invalidate_content_cache(self):
+        """Drop cached static messages and bot menu lists after a change"""
+        self._cache_gen += 1
+        self._content_cache.clear()
     
     async def get_static_messages(self):
-        """Get all static messages"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM static_messages 
-                ORDER BY day_number ASC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        """Get all static messages (cached; treat the rows as read-only)"""
+        return await self._cached_rows("static_messages", lambda: self._fetch_rows("""
+            SELECT * FROM static_messages 
+            ORDER BY day_number ASC
+        """))
+    
+    async def get_static_message(self, message_id: int):
+        """Get static message by ID"""
+        return await self._fetch_one("SELECT * FROM static_messages WHERE id = ?", (message_id,))
     
     async def update_static_message(self, message_id: int, day_number: int, text: str, html_text: str, media_type: str = 'text', media_file_id: str = None, buttons_config: str = None, send_time: str = None, additional_minutes: int = 0):
         """Update static message"""
@@ -510,134 +1281,209 @@ class Database:
             if not media_file_id:
                 media_file_id = None
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 UPDATE static_messages SET day_number = ?, text = ?, html_text = ?, media_type = ?, media_file_id = ?, buttons_config = ?, send_time = ?, additional_minutes = ? WHERE id = ?
             """, (day_number, text, html_text, media_type, media_file_id, buttons_config, send_time, additional_minutes, message_id))
             await db.commit()
+            self._invalidate_content_cache()
     
     async def delete_static_message(self, message_id: int):
         """Delete static message"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM static_messages WHERE id = ?", (message_id,))
             await db.commit()
+            self._invalidate_content_cache()
     
     async def toggle_static_message(self, message_id: int):
-        """Toggle static message active status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        """Toggle static message active status and return the new status (None if not found)"""
+        async with self._write() as db:
+            async with db.execute("""
                 UPDATE static_messages 
                 SET is_active = CASE WHEN is_active = 1 THEN 0 ELSE 1 END
                 WHERE id = ?
-            """, (message_id,))
+                RETURNING is_active
+            """, (message_id,)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+            self._invalidate_content_cache()
+            return row[0] if row else None
     
-    async def mark_static_message_sent(self, user_id: int, static_message_id: int):
-        """Mark static message as sent to a user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT OR IGNORE INTO static_messages_sent (user_id, static_message_id)
-                VALUES (?, ?)
-            """, (user_id, static_message_id))
+    @retry_on_busy()
+    async def try_mark_static_message_sent(self, user_id: int, static_message_id: int):
+        """Mark static message as sent unless it already was; returns True if this call marked it
+        
+        Lets a sender claim a message before sending it, so two senders
+        can never both deliver it to the same user.
+        """
+        async with self._write() as db:
+            async with db.execute(_SQL_MARK_STATIC_SENT, (user_id, static_message_id)) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+            return row is not None
+    
+    @retry_on_busy()
+    async def unmark_static_message_sent(self, user_id: int, static_message_id: int):
+        """Release a claim from try_mark_static_message_sent whose send failed"""
+        async with self._write() as db:
+            await db.execute(
+                "DELETE FROM static_messages_sent WHERE user_id = ? AND static_message_id = ?",
+                (user_id, static_message_id)
+            )
             await db.commit()
     
-    async def is_static_message_sent(self, user_id: int, static_message_id: int):
-        """Check if static message was already sent to a user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT COUNT(*) FROM static_messages_sent 
-                WHERE user_id = ? AND static_message_id = ?
-            """, (user_id, static_message_id)) as cursor:
-                result = await cursor.fetchone()
-                return result[0] > 0
+    async def get_static_message_targets(self, now_ts: int):
+        """Get unsent (user, static message, day) rows for non-banned users on the message's join day
+        
+        Returns read-only rows; index them by column name.
+        """
+        return await self._fetch_raw("""
+            SELECT u.user_id, u.join_ts, sm.id AS static_message_id, u.days_since_join
+            FROM (
+                SELECT user_id, join_ts, (:now - join_ts) / 86400 AS days_since_join
+                FROM users
+                WHERE is_banned = 0 AND join_ts <= :now
+            ) u
+            JOIN static_messages sm
+                ON sm.is_active = 1 AND sm.day_number = u.days_since_join
+            WHERE NOT EXISTS (
+                SELECT 1 FROM static_messages_sent s
+                WHERE s.user_id = u.user_id AND s.static_message_id = sm.id
+            )
+        """, {"now": now_ts})
     
     # Settings
+    async def _load_settings(self):
+        """Return the cached settings dict, reloading it once it's stale"""
+        now = time.monotonic()
+        if self._settings is None or now - self._settings_loaded_at > SETTINGS_CACHE_TTL:
+            rows = await self._fetch_rows("SELECT key, value FROM settings")
+            self._settings = {row['key']: row['value'] for row in rows}
+            self._settings_loaded_at = now
+        return self._settings
+    
     async def get_setting(self, key: str):
         """Get setting value"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT value FROM settings WHERE key = ?", (key,)) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else None
+        settings = await self._load_settings()
+        return settings.get(key)
     
+    @retry_on_busy()
     async def set_setting(self, key: str, value: str):
         """Set setting value"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 INSERT INTO settings (key, value) VALUES (?, ?)
                 ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
             """, (key, value))
             await db.commit()
+        if self._settings is not None:
+            self._settings[key] = value
     
     async def get_all_settings(self):
         """Get all settings"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM settings") as cursor:
-                rows = await cursor.fetchall()
-                return {row['key']: row['value'] for row in rows}
+        return dict(await self._load_settings())
     
     # Logs operations
-    async def add_log(self, level: str, source: str, message: str, details: str = None):
-        """Add log entry"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO logs (level, source, message, details)
-                VALUES (?, ?, ?, ?)
-            """, (level, source, message, details))
+    @retry_on_busy()
+    async def add_logs_many(self, rows: list):
+        """Add many (level, source, message, details) log entries at once"""
+        async with self._write() as db:
+            await db.executemany(_SQL_ADD_LOG, rows)
             await db.commit()
     
-    async def get_logs(self, source: str = None, level: str = None, limit: int = 1000, offset: int = 0):
-        """Get logs with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = "SELECT * FROM logs WHERE 1=1"
-            params = []
-            
-            if source:
-                query += " AND source = ?"
-                params.append(source)
-            
-            if level:
-                query += " AND level = ?"
-                params.append(level)
-            
-            query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-            
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def prune_logs(self, days: int):
+        """Remove log entries older than specified days and release freed pages"""
+        days = int(days)
+        total = 0
+        while True:
+            async with self._write() as db:
+                async with db.execute("""
+                    DELETE FROM logs WHERE id IN (
+                        SELECT id FROM logs
+                        WHERE created_at < datetime('now', '-' || ? || ' days')
+                        LIMIT ?
+                    )
+                """, (days, LOG_PRUNE_CHUNK)) as cursor:
+                    deleted = cursor.rowcount
+                await db.commit()
+            total += deleted
+            if deleted < LOG_PRUNE_CHUNK:
+                break
+        if not total:
+            # Nothing was freed, so skip the vacuum and its write transaction;
+            # most hourly runs end here
+            return
+        async with self._write() as db:
+            # The pragma frees one page per step; execute() would only step it
+            # once, while executescript runs it to completion and commits
+            await db.executescript(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES});")
+    
+    def _log_filters(self, source: str = None, level: str = None, before: tuple = None):
+        """Build the WHERE clauses and params shared by log queries"""
+        clauses = []
+        params = []
+        
+        if source:
+            clauses.append("source = ?")
+            params.append(source)
+        
+        if level:
+            clauses.append("level = ?")
+            params.append(level)
+        
+        if before:
+            # Keyset cursor: (created_at, id) of the last row already shown
+            clauses.append("(created_at, id) < (?, ?)")
+            params.extend(before)
+        
+        return tuple(clauses), params
+    
+    async def get_logs(self, source: str = None, level: str = None, limit: int = 1000, offset: int = 0, before: tuple = None):
+        """Get logs with optional filters
+        
+        Pass `before` (created_at, id) of the last row already shown to seek
+        straight to older entries instead of skipping `offset` rows.
+        """
+        clauses, params = self._log_filters(source, level, before)
+        if before:
+            offset = 0
+        query = _filtered_sql(_SQL_LOGS_LIST, clauses)
+        return await self._fetch_rows(query, (*params, limit, offset))
+    
+    async def get_logs_page(self, source: str = None, level: str = None, limit: int = 1000, offset: int = 0, before: tuple = None):
+        """Get a page of logs and the number of matching entries in one query
+        
+        The count covers every row matching the filters, or with `before`,
+        only the rows from the cursor on.
+        """
+        clauses, params = self._log_filters(source, level, before)
+        if before:
+            offset = 0
+        query = _filtered_sql(_SQL_LOGS_PAGE, clauses)
+        rows, total = await self._fetch_page(query, (*params, limit, offset))
+        
+        if not rows:
+            # An offset past the end returns no rows to carry the count
+            total = await self.get_logs_count(source, level) if offset else 0
+        return rows, total
     
     async def get_logs_count(self, source: str = None, level: str = None):
         """Get total logs count with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            query = "SELECT COUNT(*) FROM logs WHERE 1=1"
-            params = []
-            
-            if source:
-                query += " AND source = ?"
-                params.append(source)
-            
-            if level:
-                query += " AND level = ?"
-                params.append(level)
+        async with self._read() as db:
+            clauses, params = self._log_filters(source, level)
             
-            async with db.execute(query, params) as cursor:
+            async with db.execute(_filtered_sql(_SQL_LOGS_COUNT, clauses), params) as cursor:
                 result = await cursor.fetchone()
                 return result[0]
     
     # Admin credentials operations
     async def get_admin_credentials(self, username: str):
         """Get admin credentials"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM admin_credentials WHERE username = ?", (username,)) as cursor:
-                result = await cursor.fetchone()
-                return dict(result) if result else None
+        return await self._fetch_one("SELECT * FROM admin_credentials WHERE username = ?", (username,))
     
     async def update_admin_password(self, username: str, password_hash: str):
         """Update admin password"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 INSERT INTO admin_credentials (username, password_hash)
                 VALUES (?, ?)
@@ -647,102 +1493,127 @@ class Database:
     
     # Bot menu operations
     async def get_bot_menu(self):
-        """Get all bot menu items"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM bot_menu 
-                WHERE is_active = 1
-                ORDER BY button_order ASC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        """Get all active bot menu items (cached, read-only rows)"""
+        return await self._cached_rows("bot_menu", lambda: self._fetch_raw("""
+            SELECT * FROM bot_menu 
+            WHERE is_active = 1
+            ORDER BY button_order ASC
+        """))
     
     async def get_all_bot_menu(self):
-        """Get all bot menu items including inactive"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM bot_menu 
-                ORDER BY button_order ASC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        """Get all bot menu items including inactive (cached; treat the rows as read-only)"""
+        return await self._cached_rows("all_bot_menu", lambda: self._fetch_rows("""
+            SELECT * FROM bot_menu 
+            ORDER BY button_order ASC
+        """))
     
     async def add_bot_menu_item(self, button_name: str, button_order: int, button_type: str, action_value: str = None, inline_buttons: str = None):
-        """Add bot menu item"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        """Add bot menu item and return its id"""
+        async with self._write() as db:
+            async with db.execute(f"""
                 INSERT INTO bot_menu (button_name, button_order, button_type, action_value, inline_buttons)
-                VALUES (?, ?, ?, ?, ?)
-            """, (button_name, button_order, button_type, action_value, inline_buttons))
+                VALUES (?, ?, ?, ?, {_SQL_COMPACT_JSON})
+                RETURNING id
+            """, (button_name, button_order, button_type, action_value, inline_buttons)) as cursor:
+                menu_id = (await cursor.fetchone())[0]
             await db.commit()
+            self._invalidate_content_cache()
+            return menu_id
     
     async def update_bot_menu_item(self, menu_id: int, button_name: str, button_order: int, button_type: str, action_value: str = None, inline_buttons: str = None):
         """Update bot menu item"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        async with self._write() as db:
+            await db.execute(f"""
                 UPDATE bot_menu 
-                SET button_name = ?, button_order = ?, button_type = ?, action_value = ?, inline_buttons = ?
+                SET button_name = ?, button_order = ?, button_type = ?, action_value = ?,
+                    inline_buttons = {_SQL_COMPACT_JSON}
                 WHERE id = ?
             """, (button_name, button_order, button_type, action_value, inline_buttons, menu_id))
             await db.commit()
+            self._invalidate_content_cache()
     
     async def delete_bot_menu_item(self, menu_id: int):
         """Delete bot menu item"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM bot_menu WHERE id = ?", (menu_id,))
             await db.commit()
+            self._invalidate_content_cache()
     
     async def toggle_bot_menu_item(self, menu_id: int):
-        """Toggle bot menu item active status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        """Toggle bot menu item active status and return the new status (None if not found)"""
+        async with self._write() as db:
+            async with db.execute("""
                 UPDATE bot_menu 
                 SET is_active = CASE WHEN is_active = 1 THEN 0 ELSE 1 END
                 WHERE id = ?
-            """, (menu_id,))
+                RETURNING is_active
+            """, (menu_id,)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+            self._invalidate_content_cache()
+            return row[0] if row else None
     
     # Session operations
+    async def _load_sessions(self):
+        """Return the cached token -> session dict, loading it on first use"""
+        if self._sessions is None:
+            rows = await self._fetch_rows("SELECT * FROM sessions")
+            self._sessions = {row['session_token']: row for row in rows}
+        return self._sessions
+    
     async def create_session(self, session_token: str, username: str):
         """Create a new session"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        async with self._write() as db:
+            async with db.execute("""
                 INSERT INTO sessions (session_token, username)
                 VALUES (?, ?)
-            """, (session_token, username))
+                RETURNING *
+            """, (session_token, username)) as cursor:
+                session = dict(await cursor.fetchone())
             await db.commit()
+        if self._sessions is not None:
+            self._sessions[session_token] = session
     
     async def get_session(self, session_token: str):
         """Get session by token"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM sessions WHERE session_token = ?", (session_token,)) as cursor:
-                result = await cursor.fetchone()
-                return dict(result) if result else None
+        sessions = await self._load_sessions()
+        return sessions.get(session_token)
     
     async def delete_session(self, session_token: str):
         """Delete a session"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM sessions WHERE session_token = ?", (session_token,))
             await db.commit()
+        if self._sessions is not None:
+            self._sessions.pop(session_token, None)
     
     async def cleanup_expired_sessions(self, hours: int):
         """Remove sessions older than specified hours"""
         # Ensure hours is an integer for safety
         hours = int(hours)
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                DELETE FROM sessions 
-                WHERE created_at < datetime('now', '-' || ? || ' hours')
-            """, (hours,))
-            await db.commit()
+        # Delete in chunks, committing after each, so a large backlog doesn't
+        # hold the write lock for one long transaction
+        while True:
+            async with self._write() as db:
+                async with db.execute("""
+                    DELETE FROM sessions WHERE rowid IN (
+                        SELECT rowid FROM sessions
+                        WHERE created_at < datetime('now', '-' || ? || ' hours')
+                        LIMIT ?
+                    )
+                """, (hours, SESSION_CLEANUP_CHUNK)) as cursor:
+                    deleted = cursor.rowcount
+                await db.commit()
+            if deleted < SESSION_CLEANUP_CHUNK:
+                break
+        # Reloaded from the table on the next lookup
+        self._sessions = None
     
     # Join requests operations
+    @retry_on_busy()
     async def add_join_request(self, user_id: int, chat_id: int, username: str = None, first_name: str = None, last_name: str = None):
         """Add or update join request. Returns True if new record was inserted, False if updated."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # First check if exists to determine if it's new or update
             async with db.execute(
                 "SELECT id FROM join_requests WHERE user_id = ? AND chat_id = ?",
@@ -750,20 +1621,33 @@ class Database:
             ) as cursor:
                 exists = await cursor.fetchone() is not None
             
-            await db.execute("""
-                INSERT INTO join_requests (user_id, chat_id, username, first_name, last_name, status)
-                VALUES (?, ?, ?, ?, ?, 'pending')
-                ON CONFLICT(user_id, chat_id) DO UPDATE SET
-                    username = excluded.username,
-                    first_name = excluded.first_name,
-                    last_name = excluded.last_name,
-                    status = 'pending',
-                    request_date = CURRENT_TIMESTAMP,
-                    processed_date = NULL
-            """, (user_id, chat_id, username, first_name, last_name))
+            await db.execute(_SQL_ADD_JOIN_REQUEST, (user_id, chat_id, username, first_name, last_name))
             await db.commit()
             return not exists  # Return True if it was a new insert
     
+    @retry_on_busy()
+    async def add_join_requests_many(self, rows: list):
+        """Add or update many (user_id, chat_id, username, first_name, last_name) join requests
+        
+        Written in one transaction. Returns how many requests were new.
+        """
+        if not rows:
+            return 0
+        keys = list({(row[0], row[1]) for row in rows})
+        existing = 0
+        async with self._write() as db:
+            for start in range(0, len(keys), JOIN_REQUEST_KEY_CHUNK):
+                chunk = keys[start:start + JOIN_REQUEST_KEY_CHUNK]
+                values = ", ".join(["(?, ?)"] * len(chunk))
+                async with db.execute(
+                    f"SELECT COUNT(*) FROM join_requests WHERE (user_id, chat_id) IN (VALUES {values})",
+                    [value for key in chunk for value in key]
+                ) as cursor:
+                    existing += (await cursor.fetchone())[0]
+            await db.executemany(_SQL_ADD_JOIN_REQUEST, rows)
+            await db.commit()
+        return len(keys) - existing
+    
     def _escape_like_pattern(self, search: str) -> str:
         """Escape SQL LIKE special characters (% and _) in search string
         
@@ -778,7 +1662,11 @@ class Database:
     
     def _add_search_filter(self, query: str, params: list, search: str) -> tuple:
         """Helper method to add search filter to SQL query"""
-        if search:
+        if search and self._fts_enabled and len(search) >= 3:
+            # Trigram index lookup instead of four leading-wildcard LIKEs
+            query += " AND id IN (SELECT rowid FROM join_requests_fts WHERE join_requests_fts MATCH ?)"
+            params.append(_fts_phrase(search))
+        elif search:
             # Escape special LIKE characters
             escaped_search = self._escape_like_pattern(search)
             # Search in user_id, username, first_name, or last_name
@@ -795,164 +1683,167 @@ class Database:
             params.extend([search_pattern, search_pattern, search_pattern, search_pattern])
         return query, params
     
+    def _join_request_filters(self, status: str = None, chat_id: int = None, date_from: str = None,
+                              date_to: str = None, search: str = None, before: tuple = None):
+        """Build the WHERE clause and params shared by join request queries"""
+        where = " WHERE 1=1"
+        params = []
+        
+        if before:
+            # Keyset cursor: (request_date, id) of the last row already seen
+            where += " AND (request_date, id) < (?, ?)"
+            params.extend(before)
+        
+        if status:
+            where += " AND status = ?"
+            params.append(status)
+        
+        if chat_id:
+            where += " AND chat_id = ?"
+            params.append(chat_id)
+        
+        if date_from:
+            where += " AND request_date >= ?"
+            params.append(date_from)
+        
+        if date_to:
+            # Add one day to include the entire end date
+            where += " AND request_date < datetime(?, '+1 day')"
+            params.append(date_to)
+        
+        # Add search filter using helper method
+        return self._add_search_filter(where, params, search)
+    
     async def get_join_requests(self, status: str = 'pending', limit: int = 100, offset: int = 0, 
                                 chat_id: int = None, date_from: str = None, date_to: str = None, 
-                                older_than_count: int = None, search: str = None):
-        """Get join requests with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = "SELECT * FROM join_requests WHERE 1=1"
-            params = []
-            
-            if status:
-                query += " AND status = ?"
-                params.append(status)
-            
-            if chat_id:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            if date_from:
-                query += " AND request_date >= ?"
-                params.append(date_from)
-            
-            if date_to:
-                # Add one day to include the entire end date
-                query += " AND request_date < datetime(?, '+1 day')"
-                params.append(date_to)
-            
-            # Add search filter using helper method
-            query, params = self._add_search_filter(query, params, search)
-            
-            query += " ORDER BY request_date DESC"
-            
-            # Apply older_than_count filter if specified (skip the first N oldest results)
-            final_offset = offset
-            if older_than_count:
-                final_offset += older_than_count
-            
-            query += " LIMIT ? OFFSET ?"
-            params.extend([limit, final_offset])
-            
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                                older_than_count: int = None, search: str = None, before: tuple = None):
+        """Get join requests with optional filters
+        
+        Pass `before` (request_date, id) of the last row already seen to seek
+        straight to older requests instead of skipping `offset` rows; the
+        older_than_count skip then already lies behind the cursor.
+        """
+        where, params = self._join_request_filters(status, chat_id, date_from, date_to, search, before)
+        query = f"SELECT * FROM join_requests{where} ORDER BY request_date DESC, id DESC LIMIT ? OFFSET ?"
+        
+        # Apply older_than_count filter if specified (skip the first N oldest results)
+        final_offset = 0 if before else offset
+        if older_than_count and not before:
+            final_offset += older_than_count
+        
+        return await self._fetch_rows(query, (*params, limit, final_offset))
+    
+    async def get_join_requests_page(self, status: str = 'pending', limit: int = 100, offset: int = 0, 
+                                     chat_id: int = None, date_from: str = None, date_to: str = None, 
+                                     older_than_count: int = None, search: str = None, before: tuple = None):
+        """Get a page of join requests and the matching count in one query
+        
+        With `before`, as in get_join_requests, the count only covers the
+        rows from the cursor on.
+        """
+        where, params = self._join_request_filters(status, chat_id, date_from, date_to, search, before)
+        # Same deferred row lookup as _SQL_USERS_PAGE
+        query = f"""
+            SELECT join_requests.*, page._total FROM (
+                SELECT id, request_date, COUNT(*) OVER () AS _total FROM join_requests{where}
+                ORDER BY request_date DESC, id DESC LIMIT ? OFFSET ?
+            ) page
+            JOIN join_requests ON join_requests.id = page.id
+            ORDER BY page.request_date DESC, page.id DESC
+        """
+        
+        if before:
+            offset = 0
+            older_than_count = None
+        final_offset = offset
+        if older_than_count:
+            final_offset += older_than_count
+        
+        rows, total = await self._fetch_page(query, (*params, limit, final_offset))
+        if not rows:
+            # An offset past the end returns no rows to carry the count
+            total = await self.get_join_request_count(
+                status, chat_id, date_from, date_to, older_than_count, search
+            ) if final_offset else 0
+            return rows, total
+        
+        # Same older_than_count adjustment as get_join_request_count
+        if older_than_count and total > older_than_count:
+            total -= older_than_count
+        return rows, total
     
     async def get_join_request_count(self, status: str = 'pending', chat_id: int = None, 
                                      date_from: str = None, date_to: str = None, 
                                      older_than_count: int = None, search: str = None):
         """Get total join request count with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            query = "SELECT COUNT(*) FROM join_requests WHERE 1=1"
-            params = []
-            
-            if status:
-                query += " AND status = ?"
-                params.append(status)
-            
-            if chat_id:
-                query += " AND chat_id = ?"
-                params.append(chat_id)
-            
-            if date_from:
-                query += " AND request_date >= ?"
-                params.append(date_from)
-            
-            if date_to:
-                # Add one day to include the entire end date
-                query += " AND request_date < datetime(?, '+1 day')"
-                params.append(date_to)
-            
-            # Add search filter using helper method
-            query, params = self._add_search_filter(query, params, search)
-            
-            async with db.execute(query, params) as cursor:
+        where, params = self._join_request_filters(status, chat_id, date_from, date_to, search)
+        async with self._read() as db:
+            async with db.execute(f"SELECT COUNT(*) FROM join_requests{where}", params) as cursor:
                 result = await cursor.fetchone()
                 count = result[0]
-            
-            # Apply older_than_count filter if specified
-            if older_than_count and count > older_than_count:
-                return count - older_than_count
-            
-            return count
+        
+        # Apply older_than_count filter if specified
+        if older_than_count and count > older_than_count:
+            return count - older_than_count
+        
+        return count
     
     async def approve_join_request(self, request_id: int):
-        """Approve a join request"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE join_requests 
-                SET status = 'approved', processed_date = CURRENT_TIMESTAMP 
-                WHERE id = ?
-            """, (request_id,))
-            await db.commit()
-    
-    async def deny_join_request(self, request_id: int):
-        """Deny a join request"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE join_requests 
-                SET status = 'denied', processed_date = CURRENT_TIMESTAMP 
-                WHERE id = ?
-            """, (request_id,))
+        """Approve a join request (batched with concurrent approvals)"""
+        await self._queued_write(_SQL_SET_JOIN_REQUEST_STATUS, ('approved', _utc_timestamp(), request_id))
+    
+    async def decide_join_requests(self, approve_ids: list = (), deny_ids: list = ()):
+        """Approve some join requests and deny others in one transaction"""
+        if not approve_ids and not deny_ids:
+            return
+        # One timestamp for the whole batch, so every row records the same time
+        processed_date = _utc_timestamp()
+        rows = [('approved', processed_date, request_id) for request_id in approve_ids]
+        rows += [('denied', processed_date, request_id) for request_id in deny_ids]
+        async with self._write() as db:
+            # executemany steps the single-row UPDATE prepared once: one index
+            # lookup per id whichever the decision, with no per-length
+            # statement text or chunking
+            await db.executemany(_SQL_SET_JOIN_REQUEST_STATUS, rows)
             await db.commit()
     
-    async def approve_all_join_requests(self):
-        """Approve all pending join requests"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE join_requests 
-                SET status = 'approved', processed_date = CURRENT_TIMESTAMP 
-                WHERE status = 'pending'
-            """)
-            await db.commit()
+    async def approve_join_requests(self, request_ids: list):
+        """Approve many join requests by id in one transaction"""
+        await self.decide_join_requests(approve_ids=request_ids)
     
-    async def deny_all_join_requests(self):
-        """Deny all pending join requests"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE join_requests 
-                SET status = 'denied', processed_date = CURRENT_TIMESTAMP 
-                WHERE status = 'pending'
-            """)
-            await db.commit()
+    async def deny_join_requests(self, request_ids: list):
+        """Deny many join requests by id in one transaction"""
+        await self.decide_join_requests(deny_ids=request_ids)
     
-    async def get_join_request_by_id(self, request_id: int):
-        """Get join request by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM join_requests WHERE id = ?", (request_id,)) as cursor:
-                result = await cursor.fetchone()
-                return dict(result) if result else None
+    async def get_join_requests_by_ids(self, request_ids: list):
+        """Get the id, user_id, chat_id and status of join requests, keyed by id"""
+        requests = {}
+        for chunk in _id_chunks(request_ids):
+            async for row in self._iter_rows(_id_list_sql(_SQL_JOIN_REQUESTS_BY_IDS, len(chunk)), chunk):
+                requests[row['id']] = row
+        return requests
     
     async def get_join_requests_by_user(self, user_id: int):
         """Get all join requests for a specific user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM join_requests WHERE user_id = ? ORDER BY request_date DESC",
-                (user_id,)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows(
+            "SELECT * FROM join_requests WHERE user_id = ? ORDER BY request_date DESC",
+            (user_id,)
+        )
     
     async def get_distinct_chat_ids(self):
         """Get distinct chat_ids from join requests with basic info"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT DISTINCT chat_id, 
-                       COUNT(*) as request_count
-                FROM join_requests 
-                GROUP BY chat_id 
-                ORDER BY request_count DESC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows("""
+            SELECT DISTINCT chat_id, 
+                   COUNT(*) as request_count
+            FROM join_requests 
+            GROUP BY chat_id 
+            ORDER BY request_count DESC
+        """)
     
     # Pyrogram sessions methods
     async def add_pyrogram_session(self, session_name: str, phone_number: str, api_id: int, api_hash: str, user_info: str = None, session_type: str = 'user', bot_token: str = None):
         """Add a new Pyrogram session"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 INSERT INTO pyrogram_sessions (session_name, phone_number, api_id, api_hash, user_info, last_check, session_type, bot_token)
                 VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
@@ -961,23 +1852,15 @@ class Database:
     
     async def get_pyrogram_sessions(self):
         """Get all Pyrogram sessions"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM pyrogram_sessions ORDER BY created_at DESC") as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows("SELECT * FROM pyrogram_sessions ORDER BY created_at DESC")
     
     async def get_pyrogram_session(self, session_name: str):
         """Get a specific Pyrogram session"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM pyrogram_sessions WHERE session_name = ?", (session_name,)) as cursor:
-                result = await cursor.fetchone()
-                return dict(result) if result else None
+        return await self._fetch_one("SELECT * FROM pyrogram_sessions WHERE session_name = ?", (session_name,))
     
     async def update_pyrogram_session(self, session_name: str, user_info: str = None, is_active: int = None):
         """Update a Pyrogram session"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             if user_info is not None:
                 await db.execute("""
                     UPDATE pyrogram_sessions 
@@ -994,14 +1877,14 @@ class Database:
     
     async def delete_pyrogram_session(self, session_name: str):
         """Delete a Pyrogram session"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM pyrogram_sessions WHERE session_name = ?", (session_name,))
             await db.commit()
     
     # Invite links operations
     async def create_invite_link(self, code: str, name: str):
         """Create a new invite link"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 INSERT INTO invite_links (code, name, is_active)
                 VALUES (?, ?, 1)
@@ -1010,49 +1893,44 @@ class Database:
     
     async def get_invite_links(self):
         """Get all invite links with usage statistics"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT 
-                    il.id,
-                    il.code,
-                    il.name,
-                    il.is_active,
-                    il.created_at,
-                    COUNT(u.id) as user_count
-                FROM invite_links il
-                LEFT JOIN users u ON u.invite_code = il.code
-                GROUP BY il.id
-                ORDER BY il.created_at DESC
-            """) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows("""
+            SELECT 
+                il.id,
+                il.code,
+                il.name,
+                il.is_active,
+                il.created_at,
+                COUNT(u.id) as user_count
+            FROM invite_links il
+            LEFT JOIN users u ON u.invite_code = il.code
+            GROUP BY il.id
+            ORDER BY il.created_at DESC
+        """)
     
     async def get_invite_link_by_code(self, code: str):
         """Get invite link by code"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM invite_links WHERE code = ?
-            """, (code,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        return await self._fetch_one("""
+            SELECT * FROM invite_links WHERE code = ?
+        """, (code,))
     
     async def delete_invite_link(self, link_id: int):
         """Delete an invite link"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM invite_links WHERE id = ?", (link_id,))
             await db.commit()
     
     async def toggle_invite_link(self, link_id: int):
-        """Toggle invite link active status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        """Toggle invite link active status and return the new status (None if not found)"""
+        async with self._write() as db:
+            async with db.execute("""
                 UPDATE invite_links 
                 SET is_active = CASE WHEN is_active = 1 THEN 0 ELSE 1 END
                 WHERE id = ?
-            """, (link_id,))
+                RETURNING is_active
+            """, (link_id,)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+            return row[0] if row else None
     
     # Channel invite links methods (Telegram channel invite links)
     async def create_channel_invite_link(
@@ -1069,7 +1947,7 @@ class Database:
         is_primary: int = 0
     ):
         """Create a new channel invite link record"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # Get session_id from session_name
             async with db.execute(
                 "SELECT id FROM pyrogram_sessions WHERE session_name = ?",
@@ -1096,35 +1974,26 @@ class Database:
     
     async def get_channel_invite_links(self, session_name: str = None, channel_id: int = None):
         """Get all channel invite links with optional filters"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = "SELECT * FROM channel_invite_links WHERE 1=1"
-            params = []
-            
-            if session_name:
-                query += " AND session_name = ?"
-                params.append(session_name)
-            
-            if channel_id:
-                query += " AND channel_id = ?"
-                params.append(channel_id)
-            
-            query += " ORDER BY created_at DESC"
-            
-            async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        query = "SELECT * FROM channel_invite_links WHERE 1=1"
+        params = []
+        
+        if session_name:
+            query += " AND session_name = ?"
+            params.append(session_name)
+        
+        if channel_id:
+            query += " AND channel_id = ?"
+            params.append(channel_id)
+        
+        query += " ORDER BY created_at DESC"
+        return await self._fetch_rows(query, params)
     
     async def get_channel_invite_link_by_id(self, link_id: int):
         """Get a specific channel invite link by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM channel_invite_links WHERE id = ?",
-                (link_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        return await self._fetch_one(
+            "SELECT * FROM channel_invite_links WHERE id = ?",
+            (link_id,)
+        )
     
     async def update_channel_invite_link(
         self,
@@ -1137,7 +2006,7 @@ class Database:
         is_revoked: int = None
     ):
         """Update a channel invite link"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             updates = []
             params = []
             
@@ -1169,7 +2038,7 @@ class Database:
     
     async def delete_channel_invite_link(self, link_id: int):
         """Delete a channel invite link"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("DELETE FROM channel_invite_links WHERE id = ?", (link_id,))
             await db.commit()
     
@@ -1177,7 +2046,7 @@ class Database:
     async def add_user_question(self, question_text: str, question_type: str, options: str = None, 
                                 is_required: int = 1, order_number: int = 0):
         """Add a new user question"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 INSERT INTO user_questions (question_text, question_type, options, is_required, order_number)
                 VALUES (?, ?, ?, ?, ?)
@@ -1186,33 +2055,24 @@ class Database:
     
     async def get_user_questions(self, active_only: bool = True):
         """Get all user questions"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            query = "SELECT * FROM user_questions"
-            if active_only:
-                query += " WHERE is_active = 1"
-            query += " ORDER BY order_number ASC"
-            
-            async with db.execute(query) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        query = "SELECT * FROM user_questions"
+        if active_only:
+            query += " WHERE is_active = 1"
+        query += " ORDER BY order_number ASC"
+        return await self._fetch_rows(query)
     
     async def get_user_question(self, question_id: int):
         """Get a specific user question"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM user_questions WHERE id = ?",
-                (question_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        return await self._fetch_one(
+            "SELECT * FROM user_questions WHERE id = ?",
+            (question_id,)
+        )
     
     async def update_user_question(self, question_id: int, question_text: str = None, 
                                    question_type: str = None, options: str = None,
                                    is_required: int = None, order_number: int = None):
         """Update a user question"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             updates = []
             params = []
             
@@ -1239,18 +2099,21 @@ class Database:
                 await db.commit()
     
     async def toggle_user_question(self, question_id: int):
-        """Toggle user question active status"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        """Toggle user question active status and return the new status (None if not found)"""
+        async with self._write() as db:
+            async with db.execute("""
                 UPDATE user_questions 
                 SET is_active = CASE WHEN is_active = 1 THEN 0 ELSE 1 END
                 WHERE id = ?
-            """, (question_id,))
+                RETURNING is_active
+            """, (question_id,)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+            return row[0] if row else None
     
     async def delete_user_question(self, question_id: int):
         """Delete a user question"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # Delete associated answers first
             await db.execute("DELETE FROM user_answers WHERE question_id = ?", (question_id,))
             await db.execute("DELETE FROM user_questions WHERE id = ?", (question_id,))
@@ -1259,7 +2122,7 @@ class Database:
     # User answers methods
     async def add_user_answer(self, user_id: int, question_id: int, answer_text: str):
         """Add or update a user answer"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # Check if answer already exists
             async with db.execute("""
                 SELECT id FROM user_answers WHERE user_id = ? AND question_id = ?
@@ -1282,33 +2145,25 @@ class Database:
     
     async def get_user_answers(self, user_id: int):
         """Get all answers for a specific user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT ua.*, uq.question_text, uq.question_type
-                FROM user_answers ua
-                JOIN user_questions uq ON ua.question_id = uq.id
-                WHERE ua.user_id = ?
-                ORDER BY uq.order_number ASC
-            """, (user_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await self._fetch_rows("""
+            SELECT ua.*, uq.question_text, uq.question_type
+            FROM user_answers ua
+            JOIN user_questions uq ON ua.question_id = uq.id
+            WHERE ua.user_id = ?
+            ORDER BY uq.order_number ASC
+        """, (user_id,))
     
     async def get_user_answer(self, user_id: int, question_id: int):
         """Get a specific user answer"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM user_answers WHERE user_id = ? AND question_id = ?
-            """, (user_id, question_id)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        return await self._fetch_one("""
+            SELECT * FROM user_answers WHERE user_id = ? AND question_id = ?
+        """, (user_id, question_id))
     
     # User onboarding state methods
     async def set_user_onboarding_state(self, user_id: int, current_question_id: int = None, 
                                         static_messages_completed: int = None):
         """Set or update user onboarding state"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # Check if state exists
             async with db.execute("""
                 SELECT user_id FROM user_onboarding_state WHERE user_id = ?
@@ -1340,20 +2195,16 @@ class Database:
     
     async def get_user_onboarding_state(self, user_id: int):
         """Get user onboarding state"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM user_onboarding_state WHERE user_id = ?
-            """, (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        return await self._fetch_one("""
+            SELECT * FROM user_onboarding_state WHERE user_id = ?
+        """, (user_id,))
     
     async def complete_user_onboarding(self, user_id: int):
-        """Mark user onboarding as completed"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Mark user onboarding as completed and clear the pending question"""
+        async with self._write() as db:
             await db.execute("""
                 UPDATE user_onboarding_state 
-                SET onboarding_completed_at = CURRENT_TIMESTAMP
+                SET onboarding_completed_at = CURRENT_TIMESTAMP, current_question_id = NULL
                 WHERE user_id = ?
             """, (user_id,))
             await db.commit()
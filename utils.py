@@ -1,6 +1,15 @@
 """
 Utility functions for the bot
 """
+import asyncio
+import logging
+import queue
+
+import orjson
+
+# How often buffered log records are written to the database
+LOG_DRAIN_INTERVAL = 0.5  # seconds
+LOG_DRAIN_BATCH = 500
 
 
 def is_valid_file_id(file_id):
@@ -78,3 +87,67 @@ def normalize_media_type(media_type):
     
     # If invalid, return 'text' as default and let the caller log the warning
     return 'text'
+
+
+def log_record_details(record):
+    """
+    Build the compact details payload stored with a log entry.
+    
+    Only the call site is kept, and only for WARNING and above; serializing
+    the whole record is slow and makes every log row several KB.
+    
+    Args:
+        record: logging.LogRecord being stored
+        
+    Returns:
+        str or None: JSON string like {"f": "main", "l": 42}, or None
+    """
+    if record.levelno < logging.WARNING:
+        return None
+    return orjson.dumps({'f': record.funcName, 'l': record.lineno}).decode()
+
+
+class DatabaseLogHandler(logging.Handler):
+    """
+    Logging handler that saves records to the database.
+    
+    Records are buffered in a thread-safe queue and written in batches by
+    drain_queue(), so emit never touches the event loop or the database.
+    
+    Args:
+        db: Database the records are written to
+        source: Process name stored with every record, e.g. 'bot'
+    """
+    def __init__(self, db, source):
+        super().__init__()
+        self.db = db
+        self.source = source
+        self.queue = queue.SimpleQueue()
+    
+    def emit(self, record):
+        try:
+            self.queue.put_nowait((record.levelname, self.source, record.getMessage(), log_record_details(record)))
+        except Exception:
+            pass
+    
+    async def flush_queue(self):
+        """Write buffered log records to the database"""
+        while True:
+            batch = []
+            try:
+                while len(batch) < LOG_DRAIN_BATCH:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            try:
+                await self.db.add_logs_many(batch)
+            except Exception:
+                return
+    
+    async def drain_queue(self):
+        """Periodically move buffered log records into the database"""
+        while True:
+            await asyncio.sleep(LOG_DRAIN_INTERVAL)
+            await self.flush_queue()